@@ -26,13 +26,18 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from pyrogram import Client, idle
 
 from plugins import glovar
-from plugins.functions.etc import delay
+from plugins.functions.etc import delay, start_thread
+from plugins.functions.file import compact_journal, save_flush, save_loop
+from plugins.functions.group import delete_due_messages
 from plugins.functions.timers import (backup_files, interval_hour_01, reset_data, update_admins, update_report_ids,
                                       update_status)
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# Start the data writer
+start_thread(save_loop, ())
+
 # Config session
 app = Client(
     session_name="bot",
@@ -43,9 +48,14 @@ app.start()
 # Send online status
 delay(3, update_status, [app, "online"])
 
+# Delete the queued messages that became due while stopped
+delay(5, delete_due_messages, [app])
+
 # Timer
 scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
 scheduler.add_job(interval_hour_01, "interval", [app], hours=1)
+scheduler.add_job(compact_journal, "interval", minutes=30)
+scheduler.add_job(delete_due_messages, "interval", [app], minutes=1)
 scheduler.add_job(update_status, "cron", [app, "awake"], minute=randint(30, 34), second=randint(0, 59))
 scheduler.add_job(backup_files, "cron", [app], hour=20)
 scheduler.add_job(update_report_ids, "cron", [app], hour=21, minute=30)
@@ -58,3 +68,6 @@ idle()
 
 # Stop
 app.stop()
+
+# Write the pending data
+save_flush()
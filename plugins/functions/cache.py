@@ -0,0 +1,109 @@
+# SCP-079-WARN - Warn or ban someone by admin commands
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WARN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module is imported by glovar, so it must not import glovar
+
+import logging
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, Hashable
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    # A cache that drops entries older than ttl secs and the least recently used entries beyond size
+    def __init__(self, size: int, ttl: float, ahead: float = 0.8):
+        self.size = size
+        self.ttl = ttl
+        self.ahead = ahead
+        self.data: OrderedDict = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, False) is not None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def get(self, key: Hashable, count: bool = True) -> Any:
+        # Get a fresh value, the entry becomes the most recently used one
+        with self.lock:
+            entry = self.data.get(key)
+
+            if entry is not None and monotonic() - entry[1] > self.ttl:
+                self.data.pop(key, None)
+                entry = None
+
+            if entry is None:
+                self.misses += count
+                return None
+
+            self.data.move_to_end(key)
+            self.hits += count
+            entry[2] += count
+
+            return entry[0]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        # Remove an entry
+        with self.lock:
+            entry = self.data.pop(key, None)
+
+        return entry[0] if entry is not None else default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        # Add or replace an entry, the least recently used entries beyond size are dropped
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = [value, monotonic(), 0, False]
+
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def should_refresh(self, key: Hashable, hits: int = 2) -> bool:
+        # Check whether a hot entry is close to expiry, only the first caller is told to refresh it
+        with self.lock:
+            entry = self.data.get(key)
+
+            if (entry is None or entry[3] or entry[2] < hits
+                    or monotonic() - entry[1] < self.ttl * self.ahead):
+                return False
+
+            entry[3] = True
+            self.refreshes += 1
+
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        # Get the counters of the cache
+        with self.lock:
+            return {
+                "size": len(self.data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes
+            }
@@ -21,14 +21,16 @@ from json import dumps
 from typing import List, Optional, Union
 
 from pyrogram import Client
-from pyrogram.errors import FloodWait
 from pyrogram.types import Chat, Message
 
 from plugins import glovar
-from plugins.functions.etc import (code, code_block, general_link, get_full_name, get_command_type, lang, message_link,
-                                   thread, wait_flood)
-from plugins.functions.file import crypt_file, delete_file, get_new_path, save
+from plugins.functions.etc import (code, code_block, delay, general_link, get_full_name, get_command_type, lang,
+                                   message_link, thread)
+from plugins.functions.file import crypt_file, data_to_file, delete_file, get_new_path
+from plugins.functions.ids import update_user_score
+from plugins.functions.outbound import request
 from plugins.functions.telegram import get_group_info, get_user_bio, send_document, send_message
+from plugins.functions.wire import get_wire_text
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -94,6 +96,10 @@ def format_data(sender: str, receivers: List[str], action: str, action_type: str
     # See https://scp-079.org/exchange/
     text = ""
     try:
+        # The compact text is only sent when every receiver is configured in wire_peers
+        if glovar.wire_format != "pretty" and set(receivers) <= glovar.wire_peers:
+            return code_block(get_wire_text(sender, receivers, action, action_type, data, glovar.wire_format))
+
         data = {
             "from": sender,
             "to": receivers,
@@ -182,20 +188,15 @@ def forward_evidence(client: Client, message: Message, level: str,
             result = send_message(client, glovar.warn_channel_id, text)
             return result
 
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                result = message.forward(
-                    chat_id=glovar.warn_channel_id,
-                    disable_notification=True
-                )
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
-            except Exception as e:
-                logger.info(f"Forward evidence message error: {e}", exc_info=True)
-                return False
+        try:
+            result = request(
+                glovar.warn_channel_id, True, message.forward,
+                chat_id=glovar.warn_channel_id,
+                disable_notification=True
+            )
+        except Exception as e:
+            logger.info(f"Forward evidence message error: {e}", exc_info=True)
+            return False
 
         result = result.message_id
         result = send_message(client, glovar.warn_channel_id, text, result)
@@ -343,25 +344,74 @@ def share_data_thread(client: Client, receivers: List[str], action: str, action_
     return False
 
 
+def share_scores(client: Client) -> bool:
+    # Share the waiting score changes
+    try:
+        with glovar.locks["score"]:
+            scores = glovar.score_ids
+            glovar.score_ids = {}
+
+        if not scores:
+            return True
+
+        # Some receivers only understand single updates
+        if not glovar.score_batch:
+            for uid, score in scores.items():
+                share_data(
+                    client=client,
+                    receivers=glovar.receivers["score"],
+                    action="update",
+                    action_type="score",
+                    data={
+                        "id": uid,
+                        "score": score
+                    }
+                )
+
+            return True
+
+        data = [[uid, score] for uid, score in scores.items()]
+
+        if len(data) <= glovar.score_limit:
+            share_data(
+                client=client,
+                receivers=glovar.receivers["score"],
+                action="update",
+                action_type="scores",
+                data=data
+            )
+        else:
+            share_data(
+                client=client,
+                receivers=glovar.receivers["score"],
+                action="update",
+                action_type="scores",
+                data=len(data),
+                file=data_to_file(data)
+            )
+
+        return True
+    except Exception as e:
+        logger.warning(f"Share scores error: {e}", exc_info=True)
+
+    return False
+
+
 def update_score(client: Client, uid: int) -> bool:
     # Update a user's score, share it
     try:
-        ban_count = len(glovar.user_ids[uid]["ban"])
-        kick_count = len(glovar.user_ids[uid]["kick"])
-        warn_count = len(glovar.user_ids[uid]["warn"])
+        ban_count = len(glovar.user_ids[uid].ban)
+        kick_count = len(glovar.user_ids[uid].kick)
+        warn_count = len(glovar.user_ids[uid].warn)
         score = ban_count * 1 + kick_count * 0.3 + warn_count * 0.4
-        glovar.user_ids[uid]["score"][glovar.sender.lower()] = score
-        save("user_ids")
-        share_data(
-            client=client,
-            receivers=glovar.receivers["score"],
-            action="update",
-            action_type="score",
-            data={
-                "id": uid,
-                "score": round(score, 1)
-            }
-        )
+        update_user_score(uid, glovar.sender.lower(), score)
+
+        # The changes are shared together after a short window
+        with glovar.locks["score"]:
+            first = not glovar.score_ids
+            glovar.score_ids[uid] = round(score, 1)
+
+        first and delay(glovar.score_window, share_scores, [client])
 
         return True
     except Exception as e:
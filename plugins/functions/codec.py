@@ -0,0 +1,471 @@
+# SCP-079-WARN - Warn or ban someone by admin commands
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WARN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module is imported by glovar, so it must not import glovar
+
+import logging
+from array import array
+from itertools import chain
+from struct import Struct
+from sys import byteorder
+from typing import Any, List, Tuple
+
+from plugins.functions.status import UserStatus, set_types, total_index
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# A compact tagged binary format, only builtin types are decoded, so it is safe for untrusted input
+magic = b"C079"
+version = 1
+
+# Tags
+tag_none = 0
+tag_true = 1
+tag_false = 2
+tag_int = 3
+tag_big = 4
+tag_float = 5
+tag_str = 6
+tag_bytes = 7
+tag_list = 8
+tag_tuple = 9
+tag_set = 10
+tag_dict = 11
+tag_int_list = 12
+tag_int_set = 13
+tag_records = 14
+tag_status = 15
+tag_statuses = 16
+tag_statuses_float = 17
+tag_small = 0x80
+
+int64 = Struct("<q")
+float64 = Struct("<d")
+int_min = -1 << 63
+int_max = (1 << 63) - 1
+
+
+def decode(data: bytes) -> Any:
+    # Decode the bytes encoded by encode
+    view = memoryview(data)
+
+    if bytes(view[:4]) != magic or view[4] != version:
+        raise ValueError("not a compact encoded data")
+
+    value, position = decode_value(view, 5)
+
+    if position != len(view):
+        raise ValueError("trailing data")
+
+    return value
+
+
+def decode_value(view: memoryview, position: int) -> Tuple[Any, int]:
+    # Decode a value at the position, return (value, next position)
+    tag = view[position]
+    position += 1
+
+    if tag >= tag_small:
+        return tag - tag_small, position
+
+    if tag == tag_int:
+        return int64.unpack_from(view, position)[0], position + 8
+
+    if tag == tag_none:
+        return None, position
+
+    if tag == tag_true:
+        return True, position
+
+    if tag == tag_false:
+        return False, position
+
+    if tag == tag_float:
+        return float64.unpack_from(view, position)[0], position + 8
+
+    if tag in {tag_str, tag_bytes, tag_big}:
+        length, position = decode_length(view, position)
+        raw = bytes(view[position:position + length])
+
+        if len(raw) != length:
+            raise ValueError("truncated data")
+
+        position += length
+
+        if tag == tag_str:
+            return raw.decode("utf-8"), position
+
+        if tag == tag_bytes:
+            return raw, position
+
+        return int.from_bytes(raw, "little", signed=True), position
+
+    if tag in {tag_int_list, tag_int_set}:
+        length, position = decode_length(view, position)
+        values, position = decode_array(view, position, "q", length)
+
+        if tag == tag_int_list:
+            return values.tolist(), position
+
+        return set(values), position
+
+    if tag in {tag_list, tag_tuple, tag_set}:
+        length, position = decode_length(view, position)
+        values = []
+
+        for _ in range(length):
+            value, position = decode_value(view, position)
+            values.append(value)
+
+        if tag == tag_list:
+            return values, position
+
+        if tag == tag_tuple:
+            return tuple(values), position
+
+        return set(values), position
+
+    if tag == tag_records:
+        return decode_records(view, position)
+
+    if tag in {tag_statuses, tag_statuses_float}:
+        return decode_statuses(view, position, tag == tag_statuses_float)
+
+    if tag == tag_status:
+        values, position = decode_value(view, position)
+        status = UserStatus()
+        status.set_tuple(values)
+        return status, position
+
+    if tag == tag_dict:
+        length, position = decode_length(view, position)
+        result = {}
+
+        for _ in range(length):
+            key, position = decode_value(view, position)
+            result[key], position = decode_value(view, position)
+
+        return result, position
+
+    raise ValueError(f"unknown tag {tag}")
+
+
+def decode_array(view: memoryview, position: int, typecode: str, length: int) -> Tuple[array, int]:
+    # Decode a little-endian array
+    values = array(typecode)
+    size = values.itemsize * length
+    raw = view[position:position + size]
+
+    if len(raw) != size:
+        raise ValueError("truncated data")
+
+    values.frombytes(raw)
+    byteorder == "big" and values.byteswap()
+
+    return values, position + size
+
+
+def decode_length(view: memoryview, position: int) -> Tuple[int, int]:
+    # Decode a varint length
+    result = 0
+    shift = 0
+
+    while True:
+        byte = view[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+
+        if byte < 0x80:
+            return result, position
+
+        shift += 7
+
+
+def decode_records(view: memoryview, position: int) -> Tuple[dict, int]:
+    # Decode the columns written by encode_records
+    length, position = decode_length(view, position)
+    schema, position = decode_value(view, position)
+    keys, position = decode_array(view, position, "q", length)
+    records = [{} for _ in range(length)]
+
+    for name, kind, fields in schema:
+        if kind == "f":
+            width = len(fields)
+            values, position = decode_array(view, position, "d", length * width)
+            values = values.tolist()
+
+            for i, record in enumerate(records):
+                record[name] = dict(zip(fields, values[i * width:(i + 1) * width]))
+
+            continue
+
+        sizes, position = decode_array(view, position, "q", length)
+        total = sum(sizes)
+        items, position = decode_array(view, position, "q", total)
+        items = items.tolist()
+
+        if kind == "m":
+            values, position = decode_array(view, position, "q", total)
+            values = values.tolist()
+
+        offset = 0
+
+        for record, size in zip(records, sizes):
+            if kind == "s":
+                record[name] = set(items[offset:offset + size])
+            else:
+                record[name] = dict(zip(items[offset:offset + size], values[offset:offset + size]))
+
+            offset += size
+
+    return dict(zip(keys.tolist(), records)), position
+
+
+def decode_statuses(view: memoryview, position: int, single: bool) -> Tuple[dict, int]:
+    # Decode the columns written by encode_statuses, older data has double scores without the total
+    length, position = decode_length(view, position)
+    keys, position = decode_array(view, position, "q", length)
+    statuses = [UserStatus() for _ in range(length)]
+
+    for the_type in set_types:
+        sizes, position = decode_array(view, position, "q", length)
+        items, position = decode_array(view, position, "q", sum(sizes))
+        items = items.tolist()
+        offset = 0
+
+        for status, size in zip(statuses, sizes):
+            if size:
+                setattr(status, the_type, set(items[offset:offset + size]))
+                offset += size
+
+    width = total_index + single
+    flags, position = decode_array(view, position, "b", length)
+    scores, position = decode_array(view, position, "f" if single else "d", sum(flags) * width)
+    offset = 0
+
+    for status, flag in zip(statuses, flags):
+        if not flag:
+            continue
+
+        if single:
+            status.score = scores[offset:offset + width]
+        else:
+            status.set_tuple(([], [], [], [], scores[offset:offset + width].tolist(), {}))
+
+        offset += width
+
+    sizes, position = decode_array(view, position, "q", length)
+    items, position = decode_array(view, position, "q", sum(sizes))
+    values, position = decode_array(view, position, "q", len(items))
+    items = items.tolist()
+    values = values.tolist()
+    offset = 0
+
+    for status, size in zip(statuses, sizes):
+        if size:
+            status.warn = dict(zip(items[offset:offset + size], values[offset:offset + size]))
+            offset += size
+
+    return dict(zip(keys.tolist(), statuses)), position
+
+
+def encode(data: Any) -> bytes:
+    # Encode builtin data to bytes
+    chunks = [magic, bytes([version])]
+    encode_value(data, chunks)
+
+    return b"".join(chunks)
+
+
+def encode_length(length: int) -> bytes:
+    # Encode a varint length
+    result = bytearray()
+
+    while length >= 0x80:
+        result.append(length & 0x7f | 0x80)
+        length >>= 7
+
+    result.append(length)
+
+    return bytes(result)
+
+
+def encode_records(value: dict, chunks: List[bytes]) -> bool:
+    # Encode a dict of int keys to same-shaped records by columns, return False if the data does not fit
+    # A record field is a set of ints (s), a dict of str keys to floats (f) or a dict of int keys to ints (m)
+    first = next(iter(value.values()))
+
+    if type(first) is not dict:
+        return False
+
+    schema = []
+
+    for name, item in first.items():
+        if type(item) is set:
+            schema.append((name, "s", ()))
+        elif type(item) is dict and item and all(type(key) is str for key in item):
+            schema.append((name, "f", tuple(item)))
+        elif type(item) is dict:
+            schema.append((name, "m", ()))
+        else:
+            return False
+
+    try:
+        records = list(value.values())
+
+        if any(type(record) is not dict or record.keys() != first.keys() for record in records):
+            return False
+
+        columns = [array("q", value)]
+
+        for name, kind, fields in schema:
+            items = [record[name] for record in records]
+
+            if kind == "f":
+                if any(type(item) is not dict or tuple(item) != fields for item in items):
+                    return False
+
+                columns.append(array("d", chain.from_iterable(item.values() for item in items)))
+                continue
+
+            if any(type(item) is not (set if kind == "s" else dict) for item in items):
+                return False
+
+            columns.append(array("q", map(len, items)))
+            columns.append(array("q", chain.from_iterable(items)))
+
+            if kind == "m":
+                columns.append(array("q", chain.from_iterable(item.values() for item in items)))
+    except (OverflowError, TypeError):
+        return False
+
+    chunks.append(bytes((tag_records,)))
+    chunks.append(encode_length(len(value)))
+    encode_value(schema, chunks)
+
+    for column in columns:
+        byteorder == "big" and column.byteswap()
+        chunks.append(column.tobytes())
+
+    return True
+
+
+def encode_statuses(value: dict, chunks: List[bytes]) -> bool:
+    # Encode a dict of int keys to user statuses by columns, return False if the data does not fit
+    statuses = list(value.values())
+
+    if any(type(status) is not UserStatus for status in statuses):
+        return False
+
+    try:
+        columns = [array("q", value)]
+
+        # Every set, dict and array is read once, so the sizes and the items of a column always agree
+        for the_type in set_types:
+            items = [tuple(getattr(status, the_type)) for status in statuses]
+            columns.append(array("q", map(len, items)))
+            columns.append(array("q", chain.from_iterable(items)))
+
+        scores = [status.score is not None and status.score.tolist() or None for status in statuses]
+        columns.append(array("b", (score is not None for score in scores)))
+        columns.append(array("f", chain.from_iterable(score for score in scores if score is not None)))
+        items = [tuple(status.warn.items()) for status in statuses]
+        columns.append(array("q", map(len, items)))
+        columns.append(array("q", (gid for item in items for gid, _ in item)))
+        columns.append(array("q", (count for item in items for _, count in item)))
+    except (OverflowError, TypeError):
+        return False
+
+    chunks.append(bytes((tag_statuses_float,)))
+    chunks.append(encode_length(len(value)))
+
+    for column in columns:
+        byteorder == "big" and column.byteswap()
+        chunks.append(column.tobytes())
+
+    return True
+
+
+def encode_value(value: Any, chunks: List[bytes]) -> None:
+    # Encode a value to the chunks
+    the_type = type(value)
+
+    if the_type is int:
+        if 0 <= value < tag_small:
+            chunks.append(bytes((tag_small + value,)))
+        elif int_min <= value <= int_max:
+            chunks.append(bytes((tag_int,)))
+            chunks.append(int64.pack(value))
+        else:
+            raw = value.to_bytes((value.bit_length() + 8) // 8, "little", signed=True)
+            chunks.append(bytes((tag_big,)))
+            chunks.append(encode_length(len(raw)))
+            chunks.append(raw)
+    elif the_type is str:
+        raw = value.encode("utf-8")
+        chunks.append(bytes((tag_str,)))
+        chunks.append(encode_length(len(raw)))
+        chunks.append(raw)
+    elif the_type is dict and value and type(next(iter(value.values()))) is UserStatus and (
+            encode_statuses(value, chunks)):
+        pass
+    elif the_type is dict and len(value) > 1 and encode_records(value, chunks):
+        pass
+    elif the_type is dict:
+        chunks.append(bytes((tag_dict,)))
+        chunks.append(encode_length(len(value)))
+
+        for key, item in value.items():
+            encode_value(key, chunks)
+            encode_value(item, chunks)
+    elif the_type in {list, set} and value and all(type(item) is int and int_min <= item <= int_max
+                                                   for item in value):
+        values = array("q", value)
+        byteorder == "big" and values.byteswap()
+        chunks.append(bytes((tag_int_list if the_type is list else tag_int_set,)))
+        chunks.append(encode_length(len(values)))
+        chunks.append(values.tobytes())
+    elif the_type in {list, tuple, set}:
+        chunks.append(bytes(({list: tag_list, tuple: tag_tuple, set: tag_set}[the_type],)))
+        chunks.append(encode_length(len(value)))
+
+        for item in value:
+            encode_value(item, chunks)
+    elif the_type is float:
+        chunks.append(bytes((tag_float,)))
+        chunks.append(float64.pack(value))
+    elif value is None:
+        chunks.append(bytes((tag_none,)))
+    elif the_type is bool:
+        chunks.append(bytes((tag_true if value else tag_false,)))
+    elif the_type is UserStatus:
+        chunks.append(bytes((tag_status,)))
+        encode_value(value.to_tuple(), chunks)
+    elif the_type is bytes:
+        chunks.append(bytes((tag_bytes,)))
+        chunks.append(encode_length(len(value)))
+        chunks.append(value)
+    else:
+        raise TypeError(f"cannot encode {the_type.__name__}")
+
+
+def is_encoded(data: bytes) -> bool:
+    # Check if the bytes are compact encoded
+    return data[:4] == magic
+
@@ -17,14 +17,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from concurrent.futures import Future
 from datetime import datetime
+from heapq import heapify, heappop, heappush
 from html import escape
 from json import dumps, loads
 from random import choice, uniform
 from string import ascii_letters, digits
-from threading import Thread, Timer
-from time import localtime, sleep, strftime, time
-from typing import Any, Callable, List, Optional, Union
+from threading import RLock, Thread
+from time import localtime, monotonic, sleep, strftime, time
+from typing import Any, Callable, Dict, List, Optional, Union
 
 from cryptography.fernet import Fernet
 from pyrogram.errors import FloodWait
@@ -64,6 +66,25 @@ def button_data(action: str, action_type: str = None, data: Union[int, str] = No
     return result
 
 
+def cancel_delay(timer_id: int) -> bool:
+    # Cancel a delayed call that has not been dispatched
+    result = False
+
+    try:
+        with glovar.timer_condition:
+            result = timer_id in glovar.timer_ids
+            glovar.timer_ids.discard(timer_id)
+
+            # Drop the cancelled timers once they make up most of the heap
+            if len(glovar.timers) > 2 * len(glovar.timer_ids) + 64:
+                glovar.timers = [t for t in glovar.timers if t[1] in glovar.timer_ids]
+                heapify(glovar.timers)
+    except Exception as e:
+        logger.warning(f"Cancel delay error: {e}", exc_info=True)
+
+    return result
+
+
 def code(text: Any) -> str:
     # Get a code text
     try:
@@ -108,18 +129,45 @@ def crypt_str(operation: str, text: str, key: bytes) -> str:
     return result
 
 
-def delay(secs: int, target: Callable, args: list) -> bool:
-    # Call a function with delay
+def delay(secs: float, target: Callable, args: list) -> int:
+    # Call a function with delay, return the timer id
+    result = 0
+
     try:
-        t = Timer(secs, target, args)
-        t.daemon = True
-        t.start()
+        with glovar.timer_condition:
+            glovar.timer_count += 1
+            result = glovar.timer_count
+            heappush(glovar.timers, (monotonic() + secs, result, target, args))
+            glovar.timer_ids.add(result)
 
-        return True
+            if not glovar.timer_started:
+                glovar.timer_started = start_thread(delay_loop, ())
+
+            glovar.timer_condition.notify()
     except Exception as e:
         logger.warning(f"Delay error: {e}", exc_info=True)
 
-    return False
+    return result
+
+
+def delay_loop() -> bool:
+    # Dispatch the delayed calls from one thread
+    while True:
+        try:
+            with glovar.timer_condition:
+                while not glovar.timers or glovar.timers[0][0] > monotonic():
+                    glovar.timer_condition.wait(glovar.timers and glovar.timers[0][0] - monotonic() or None)
+
+                _, timer_id, target, args = heappop(glovar.timers)
+
+                if timer_id not in glovar.timer_ids:
+                    continue
+
+                glovar.timer_ids.discard(timer_id)
+
+            thread(target, tuple(args))
+        except Exception as e:
+            logger.warning(f"Delay loop error: {e}", exc_info=True)
 
 
 def general_link(text: Union[int, str], link: str) -> str:
@@ -218,6 +266,25 @@ def get_command_type(message: Message) -> str:
     return result
 
 
+def get_delays() -> Dict[str, Union[float, int]]:
+    # Get the metrics of the pending delayed calls
+    result = {}
+
+    try:
+        with glovar.timer_condition:
+            pending = len(glovar.timer_ids)
+            result = {
+                "pending": pending,
+                "cancelled": len(glovar.timers) - pending,
+                "scheduled": glovar.timer_count,
+                "next": glovar.timers and max(glovar.timers[0][0] - monotonic(), 0.0) or 0.0
+            }
+    except Exception as e:
+        logger.warning(f"Get delays error: {e}", exc_info=True)
+
+    return result
+
+
 def get_full_name(user: User) -> str:
     # Get user's full name
     text = ""
@@ -234,6 +301,11 @@ def get_full_name(user: User) -> str:
     return text
 
 
+def get_group_lock(gid: int) -> RLock:
+    # Get the lock stripe of a group
+    return glovar.group_locks[gid % glovar.lock_stripes]
+
+
 def get_id(update: Union[CallbackQuery, Message]) -> (int, int):
     # Check update's chat_id and user_id
     cid = 0
@@ -308,6 +380,30 @@ def get_text(message: Message) -> str:
     return text
 
 
+def get_threads() -> Dict[str, Dict[str, int]]:
+    # Get the metrics of the thread pools
+    result = {}
+
+    try:
+        with glovar.locks["thread"]:
+            result = {pool: {
+                "dropped": glovar.thread_dropped[pool],
+                "overflow": len(glovar.thread_overflow[pool]),
+                "pending": glovar.thread_pending[pool],
+                "saturated": glovar.thread_saturated[pool],
+                "workers": glovar.thread_pools[pool]._max_workers
+            } for pool in glovar.thread_pools}
+    except Exception as e:
+        logger.warning(f"Get threads error: {e}", exc_info=True)
+
+    return result
+
+
+def get_user_lock(uid: int) -> RLock:
+    # Get the lock stripe of a user
+    return glovar.user_locks[uid % glovar.lock_stripes]
+
+
 def lang(text: str) -> str:
     # Get the text
     result = ""
@@ -353,6 +449,18 @@ def random_str(i: int) -> str:
     return text
 
 
+def start_thread(target: Callable, args: tuple) -> bool:
+    # Start a dedicated thread for a long-running loop, the pools are only for short calls
+    result = False
+
+    try:
+        result = Thread(target=target, args=args, daemon=True).start() or True
+    except Exception as e:
+        logger.warning(f"Start thread error: {e}", exc_info=True)
+
+    return result
+
+
 def t2t(text: str, normal: bool, printable: bool) -> str:
     # Convert the string, text to text
     try:
@@ -370,20 +478,78 @@ def t2t(text: str, normal: bool, printable: bool) -> str:
     return text
 
 
-def thread(target: Callable, args: tuple, kwargs: dict = None, daemon: bool = True) -> bool:
-    # Call a function using thread
+def thread(target: Callable, args: tuple, kwargs: dict = None, daemon: bool = True, pool: str = "io") -> bool:
+    # Call a function in a thread pool, the call waits in the overflow queue when the pool is saturated
     result = False
 
     try:
-        t = Thread(target=target, args=args, kwargs=kwargs, daemon=daemon)
-        t.daemon = daemon
-        result = t.start() or True
+        with glovar.locks["thread"]:
+            saturated = glovar.thread_pending[pool] >= glovar.thread_limits[pool]
+
+            # The call never runs in the caller, which may be the timer dispatcher or hold a lock the call needs
+            if saturated and len(glovar.thread_overflow[pool]) < glovar.thread_overflow_limit:
+                glovar.thread_saturated[pool] += 1
+                glovar.thread_overflow[pool].append((target, args, kwargs or {}))
+                return True
+
+            if saturated:
+                glovar.thread_dropped[pool] += 1
+                logger.warning(f"Thread call {target.__name__} dropped, the {pool} pool is saturated")
+                return False
+
+            glovar.thread_pending[pool] += 1
+
+        # daemon is kept for the callers, the pool threads finish the queued calls at exit
+        thread_submit(pool, target, args, kwargs or {})
+        result = True
     except Exception as e:
         logger.warning(f"Thread error: {e}", exc_info=True)
 
     return result
 
 
+def thread_done(pool: str, future: Future) -> bool:
+    # Count a finished call of a thread pool and log its error, the next waiting call takes its place
+    try:
+        with glovar.locks["thread"]:
+            if glovar.thread_overflow[pool]:
+                call = glovar.thread_overflow[pool].popleft()
+            else:
+                call = None
+                glovar.thread_pending[pool] -= 1
+
+        call and thread_submit(pool, *call)
+
+        error = future.exception()
+        error and logger.warning(f"Thread call error: {error}", exc_info=error)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Thread done error: {e}", exc_info=True)
+
+    return False
+
+
+def thread_map(target: Callable, *iterables: Any, pool: str = "cpu") -> List[Any]:
+    # Call a function for the items in a thread pool and return the results, the calls are counted as pending
+    calls = list(zip(*iterables))
+
+    with glovar.locks["thread"]:
+        glovar.thread_pending[pool] += len(calls)
+
+    futures = [thread_submit(pool, target, call, {}) for call in calls]
+
+    return [future.result() for future in futures]
+
+
+def thread_submit(pool: str, target: Callable, args: tuple, kwargs: dict) -> Future:
+    # Submit a counted call to a thread pool
+    future = glovar.thread_pools[pool].submit(target, *args, **kwargs)
+    future.add_done_callback(lambda f: thread_done(pool, f))
+
+    return future
+
+
 def wait_flood(e: FloodWait) -> bool:
     # Wait flood secs
     try:
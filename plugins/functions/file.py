@@ -19,21 +19,38 @@
 import logging
 from os import remove
 from os.path import exists
-from pickle import dump
-from shutil import copyfile
-from typing import Any
+from pickle import dumps
+from time import sleep
+from typing import Any, List, Tuple
 
 from pyAesCrypt import decryptFile, encryptFile
 from pyrogram import Client
 
 from plugins import glovar
-from plugins.functions.etc import random_str, thread
+from plugins.functions.etc import get_user_lock, random_str, thread_map
+from plugins.functions.codec import encode
+from plugins.functions.snapshot import get_shard, load_shards, load_snapshot, write_record, write_snapshot
+from plugins.functions.status import UserStatus
+from plugins.functions.store import commit
 from plugins.functions.telegram import download_media
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def compact_journal() -> bool:
+    # Compact the user data journal into a new snapshot
+    try:
+        if glovar.journal_size or glovar.journal_ops:
+            save("user_ids")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Compact journal error: {e}", exc_info=True)
+
+    return False
+
+
 def crypt_file(operation: str, file_in: str, file_out: str) -> bool:
     # Encrypt or decrypt a file
     try:
@@ -53,13 +70,13 @@ def crypt_file(operation: str, file_in: str, file_out: str) -> bool:
     return False
 
 
-def data_to_file(data: Any) -> str:
-    # Save data to a file in tmp directory
+def data_to_file(data: Any, compact: bool = False) -> str:
+    # Save data to a file in tmp directory, other bots read pickle unless the compact format is requested
     try:
         file_path = get_new_path()
 
         with open(file_path, "wb") as f:
-            dump(data, f)
+            f.write(encode(data) if compact else dumps(data))
 
         return file_path
     except Exception as e:
@@ -81,6 +98,22 @@ def delete_file(path: str) -> bool:
     return False
 
 
+def get_copy(data: Any) -> Any:
+    # Copy the containers of the data, the immutable leaves are shared
+    the_type = type(data)
+
+    if the_type is dict:
+        return {key: get_copy(value) for key, value in data.copy().items()}
+
+    if the_type is list:
+        return [get_copy(value) for value in data.copy()]
+
+    if the_type is set or the_type is UserStatus:
+        return data.copy()
+
+    return data
+
+
 def get_downloaded_path(client: Client, file_id: str) -> str:
     # Download file, get it's path on local machine
     result = ""
@@ -113,10 +146,69 @@ def get_new_path(extension: str = "") -> str:
     return result
 
 
+def get_snapshot(file: str) -> Tuple[int, Any]:
+    # Take a copy of a global variable and its new generation, no lock is held
+    generation = glovar.generations.get(file, 0) + 1
+
+    # Each dict.copy() and set.copy() is atomic under the GIL, so a concurrent writer never breaks the copy,
+    # a write that the copy misses calls save() again, and the next snapshot contains it
+    data = get_copy(eval(f"glovar.{file}"))
+
+    return generation, data
+
+
+def journal(op: str, uid: int, *args: Any) -> bool:
+    # Append a user data mutation to the journal
+    try:
+        with glovar.locks["save"]:
+            glovar.journal_ops.append((op, uid) + args)
+
+        glovar.save_event.set()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Journal error: {e}", exc_info=True)
+
+    return False
+
+
+def journal_batch(ops: List[tuple]) -> bool:
+    # Append many user data mutations to the journal at once
+    try:
+        with glovar.locks["save"]:
+            glovar.journal_ops.extend(ops)
+
+        glovar.save_event.set()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Journal batch error: {e}", exc_info=True)
+
+    return False
+
+
+def journal_thread(ops: List[tuple]) -> bool:
+    # Append the mutations to the journal file
+    try:
+        with open("data/user_ids.journal", "ab") as f:
+            write_record(f, ops)
+            f.flush()
+            glovar.journal_size = f.tell()
+
+        return True
+    except Exception as e:
+        logger.error(f"Journal thread error: {e}", exc_info=True)
+
+    return False
+
+
 def save(file: str) -> bool:
-    # Save a global variable to a file
+    # Mark a global variable to be saved by the writer
     try:
-        thread(save_thread, (file,))
+        with glovar.locks["save"]:
+            glovar.saves.add(file)
+
+        glovar.save_event.set()
 
         return True
     except Exception as e:
@@ -125,19 +217,124 @@ def save(file: str) -> bool:
     return False
 
 
+def save_flush() -> bool:
+    # Write all the marked global variables now
+    try:
+        with glovar.locks["file"]:
+            glovar.save_event.clear()
+
+            with glovar.locks["save"]:
+                files = glovar.saves
+                glovar.saves = set()
+                ops = glovar.journal_ops
+                glovar.journal_ops = []
+
+            # The mutations are written first, a snapshot taken afterwards always contains them
+            if ops and glovar.sqlite:
+                glovar.user_ids.apply(ops, {op[1] for op in glovar.journal_ops})
+            elif ops:
+                journal_thread(ops)
+                glovar.user_dirty.update(range(glovar.user_shards) if any(op[0] == "drop" for op in ops)
+                                         else {op[1] % glovar.user_shards for op in ops})
+
+            if glovar.journal_size > glovar.journal_limit:
+                files.add("user_ids")
+
+            for file in files:
+                save_thread(file)
+
+        return True
+    except Exception as e:
+        logger.error(f"Save flush error: {e}", exc_info=True)
+
+    return False
+
+
+def save_loop() -> None:
+    # Writer loop, coalesce the saves requested within the latency window into one write per file
+    while True:
+        try:
+            glovar.save_event.wait()
+            sleep(glovar.save_latency)
+            save_flush()
+        except Exception as e:
+            logger.error(f"Save loop error: {e}", exc_info=True)
+
+
+def save_shards() -> bool:
+    # Save the user data shards changed since the last snapshot
+    dirty = glovar.user_dirty
+    glovar.user_dirty = set()
+
+    try:
+        shards = {index: {} for index in dirty}
+
+        for uid in list(glovar.user_ids):
+            index = uid % glovar.user_shards
+
+            if index not in shards:
+                continue
+
+            # The handlers change the records in place, so the encoder only gets copies taken under the user locks
+            with get_user_lock(uid):
+                record = get_copy(glovar.user_ids.get(uid))
+
+            if record is not None:
+                shards[index][uid] = record
+
+        # The shards are serialized and synced in the CPU pool
+        names = [get_shard("users", index) for index in shards]
+        generations = [glovar.generations.get(name, 0) + 1 for name in names]
+        thread_map(write_snapshot, names, generations, shards.values())
+        glovar.generations.update(zip(names, generations))
+
+        # Every shard has been written, so the snapshot includes all the journaled mutations
+        with open("data/user_ids.journal", "wb"):
+            glovar.journal_size = 0
+    except Exception:
+        glovar.user_dirty |= dirty
+        raise
+
+    return True
+
+
 def save_thread(file: str) -> bool:
-    # Save thread
+    # Save a global variable to a file
     try:
         if not glovar:
             return True
 
-        with open(f"data/.{file}", "wb") as f:
-            dump(eval(f"glovar.{file}"), f)
+        if glovar.sqlite and file in glovar.sqlite_list:
+            return commit(eval(f"glovar.{file}"))
+
+        if file == "user_ids":
+            return save_shards()
 
-        copyfile(f"data/.{file}", f"data/{file}")
+        # Only the copy is taken under the lock, the serialization runs outside of it
+        generation, data = get_snapshot(file)
+        write_snapshot(file, generation, data)
+        glovar.generations[file] = generation
 
         return True
     except Exception as e:
         logger.error(f"Save thread error: {e}", exc_info=True)
 
     return False
+
+
+def snapshot_to_file(file: str) -> str:
+    # Save the newest snapshot of a file to a file in tmp directory, in the compact format without the header
+    try:
+        if file == "user_ids":
+            generation, data = 0, load_shards("users", glovar.user_shards)[1]
+        else:
+            generation, data = load_snapshot(file)
+
+        if generation < 0:
+            return ""
+
+        return data_to_file(data, True)
+    except Exception as e:
+        logger.warning(f"Snapshot to file error: {e}", exc_info=True)
+
+    return ""
@@ -266,10 +266,8 @@ def is_class_e_user(user: Union[int, User]) -> bool:
         if uid in glovar.bot_ids:
             return True
 
-        group_list = list(glovar.admin_ids)
-        for gid in group_list:
-            if uid in glovar.admin_ids.get(gid, set()):
-                return True
+        if glovar.admin_groups.get(uid):
+            return True
     except Exception as e:
         logger.warning(f"Is class e user error: {e}", exc_info=True)
 
@@ -295,12 +293,12 @@ def is_high_score_user(user: User) -> float:
             return 0.0
 
         uid = user.id
-        user_status = glovar.user_ids.get(uid, {})
+        user_status = glovar.user_ids.get(uid)
 
         if not user_status:
             return 0.0
 
-        score = sum(user_status["score"].values())
+        score = user_status.get_total()
         if score >= 3.0:
             return score
     except Exception as e:
@@ -17,28 +17,112 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from typing import List, Optional
+from typing import Iterable, List, Optional
 
 from pyrogram import Client
-from pyrogram.types import ChatMember, Message
+from pyrogram.types import ChatMember, InlineKeyboardMarkup, Message
 
 from plugins import glovar
-from plugins.functions.etc import code, lang, thread
+from plugins.functions.decorators import threaded
+from plugins.functions.etc import code, delay, get_now, lang, thread
 from plugins.functions.file import save
-from plugins.functions.telegram import delete_messages, get_messages, leave_chat
+from plugins.functions.ids import remove_admin_ids, update_admin_ids
+from plugins.functions.telegram import delete_messages, get_messages, leave_chat, send_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
-def delete_message(client: Client, gid: int, mid: int) -> bool:
-    # Delete a single message
+def delete_buffered_messages(client: Client, gid: int) -> bool:
+    # Delete the buffered messages of a group in one batch
+    try:
+        with glovar.locks["delete"]:
+            mids = glovar.delete_buffer.pop(gid, [])
+
+        mids and delete_messages(client, gid, mids)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Delete buffered messages error: {e}", exc_info=True)
+
+    return False
+
+
+def delete_due_messages(client: Client, gid: int = 0) -> bool:
+    # Delete the queued messages that are due in a group, or in all groups
+    try:
+        now = get_now()
+        batches = {}
+
+        with glovar.locks["delete"]:
+            for cid in ([gid] if gid else list(glovar.delete_ids)):
+                mids = glovar.delete_ids.get(cid, {})
+                due = [mid for mid in mids if mids[mid] <= now]
+
+                if not due:
+                    continue
+
+                batches[cid] = due
+
+                for mid in due:
+                    mids.pop(mid, 0)
+
+                mids or glovar.delete_ids.pop(cid, {})
+
+        if not batches:
+            return True
+
+        save("delete_ids")
+
+        for cid in batches:
+            delete_messages(client, cid, batches[cid])
+
+        return True
+    except Exception as e:
+        logger.warning(f"Delete due messages error: {e}", exc_info=True)
+
+    return False
+
+
+def delete_later(client: Client, gid: int, mids: Iterable[int], secs: int) -> bool:
+    # Queue some messages to be deleted after secs, the queue is saved and survives restarts
+    try:
+        due = get_now() + secs
+
+        with glovar.locks["delete"]:
+            glovar.delete_ids.setdefault(gid, {}).update({mid: due for mid in mids})
+
+        save("delete_ids")
+        delay(secs, delete_due_messages, [client, gid])
+
+        return True
+    except Exception as e:
+        logger.warning(f"Delete later error: {e}", exc_info=True)
+
+    return False
+
+
+def delete_message(client: Client, gid: int, mid: int, secs: int = 0) -> bool:
+    # Delete a single message, now or after secs
     try:
         if not gid or not mid:
             return True
 
         mids = [mid]
-        thread(delete_messages, (client, gid, mids))
+
+        if secs:
+            return delete_later(client, gid, mids, secs)
+
+        # Deletions in a group are buffered for a short window, then sent in one batch
+        with glovar.locks["delete"]:
+            buffer = glovar.delete_buffer.setdefault(gid, [])
+            buffer.append(mid)
+            count = len(buffer)
+
+        if count >= glovar.delete_limit:
+            thread(delete_buffered_messages, (client, gid))
+        elif count == 1:
+            delay(glovar.delete_window, delete_buffered_messages, [client, gid])
 
         return True
     except Exception as e:
@@ -97,8 +181,7 @@ def leave_group(client: Client, gid: int) -> bool:
         save("left_group_ids")
         thread(leave_chat, (client, gid))
 
-        glovar.admin_ids.pop(gid, None)
-        save("admin_ids")
+        remove_admin_ids(gid)
 
         glovar.message_ids.pop(gid, (0, 0))
         save("message_ids")
@@ -106,6 +189,8 @@ def leave_group(client: Client, gid: int) -> bool:
         glovar.configs.pop(gid, None)
         save("configs")
 
+        glovar.chats.pop(gid)
+
         return True
     except Exception as e:
         logger.warning(f"Leave group error: {e}", exc_info=True)
@@ -119,13 +204,12 @@ def save_admins(gid: int, admin_members: List[ChatMember]) -> bool:
 
     try:
         # Admin list
-        glovar.admin_ids[gid] = {admin.user.id for admin in admin_members
-                                 if (((not admin.user.is_bot and not admin.user.is_deleted)
-                                      and admin.can_delete_messages
-                                      and admin.can_restrict_members)
-                                     or admin.status == "creator"
-                                     or admin.user.id in glovar.bot_ids)}
-        save("admin_ids")
+        update_admin_ids(gid, {admin.user.id for admin in admin_members
+                               if (((not admin.user.is_bot and not admin.user.is_deleted)
+                                    and admin.can_delete_messages
+                                    and admin.can_restrict_members)
+                                   or admin.status == "creator"
+                                   or admin.user.id in glovar.bot_ids)})
 
         # Trust list
         glovar.trust_ids[gid] = {admin.user.id for admin in admin_members
@@ -138,3 +222,30 @@ def save_admins(gid: int, admin_members: List[ChatMember]) -> bool:
         logger.warning(f"Save admins error: {e}", exc_info=True)
 
     return result
+
+
+@threaded()
+def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int = None,
+                        markup: InlineKeyboardMarkup = None) -> Optional[bool]:
+    # Send a message that will be auto deleted to a chat
+    result = None
+
+    try:
+        result = send_message(
+            client=client,
+            cid=cid,
+            text=text,
+            mid=mid,
+            markup=markup
+        )
+
+        if not result:
+            return None
+
+        mid = result.message_id
+        mids = [mid]
+        result = delete_later(client, cid, mids, secs)
+    except Exception as e:
+        logger.warning(f"Send report message to {cid} error: {e}", exc_info=True)
+
+    return result
@@ -18,14 +18,194 @@
 
 import logging
 from copy import deepcopy
+from heapq import heapify, heappush
+from typing import Dict, Iterable, List, Set, Tuple, Union
 
 from plugins import glovar
-from plugins.functions.file import save
+from plugins.functions.etc import get_group_lock, get_user_lock
+from plugins.functions.file import journal, journal_batch, save
+from plugins.functions.status import UserStatus, get_user_status
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def add_expiry(the_type: str, key: Union[int, str], time: int) -> bool:
+    # Add a record to the expiry index, the record is checked again when it expires
+    try:
+        heappush(glovar.expiry_ids, (time, the_type, key))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add expiry error: {e}", exc_info=True)
+
+    return False
+
+
+def add_report(key: str, report_record: dict) -> bool:
+    # Add a report, keep the expiry index and the reported users index in sync
+    try:
+        uid = report_record["user_id"]
+        glovar.reports[key] = report_record
+        glovar.report_users[uid] = glovar.report_users.get(uid, 0) + 1
+        add_expiry("reports", key, report_record["time"])
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add report error: {e}", exc_info=True)
+
+    return False
+
+
+def add_user_status(uid: int, the_type: str, gid: int) -> bool:
+    # Add the group to the user's status set
+    try:
+        with get_user_lock(uid):
+            glovar.user_ids[uid].add(the_type, gid)
+            journal("add", uid, the_type, gid)
+            the_type == "waiting" and glovar.waiting_ids.add(uid)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add user {uid} status {the_type} error: {e}", exc_info=True)
+
+    return False
+
+
+def add_user_warn(uid: int, gid: int, count: int = 1) -> int:
+    # Add to the user's warn count in the group, return the new count
+    result = 0
+
+    try:
+        with get_user_lock(uid):
+            result = max(glovar.user_ids[uid].warn.get(gid, 0) + count, 0)
+            update_user_warn(uid, gid, result)
+    except Exception as e:
+        logger.warning(f"Add user {uid} warn error: {e}", exc_info=True)
+
+    return result
+
+
+def check_admin_groups() -> bool:
+    # Check the reverse admin index against the admin lists, rebuild it if they differ
+    try:
+        admin_groups = get_admin_groups()
+
+        if admin_groups == glovar.admin_groups:
+            return True
+
+        logger.warning("The reverse admin index is inconsistent, rebuilt")
+        glovar.admin_groups = admin_groups
+    except Exception as e:
+        logger.warning(f"Check admin groups error: {e}", exc_info=True)
+
+    return False
+
+
+def clear_user_ids() -> bool:
+    # Clear all user data
+    try:
+        glovar.user_ids.clear()
+        glovar.waiting_ids.clear()
+        journal("drop", 0)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Clear user ids error: {e}", exc_info=True)
+
+    return False
+
+
+def clear_user_status(uid: int, the_type: str) -> bool:
+    # Clear the user's status set
+    try:
+        with get_user_lock(uid):
+            the_type == "waiting" and glovar.waiting_ids.discard(uid)
+            glovar.user_ids[uid].clear(the_type)
+            journal("clear", uid, the_type)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Clear user {uid} status {the_type} error: {e}", exc_info=True)
+
+    return False
+
+
+def discard_user_status(uid: int, the_type: str, gid: int) -> bool:
+    # Discard the group from the user's status set
+    try:
+        with get_user_lock(uid):
+            glovar.user_ids[uid].discard(the_type, gid)
+            journal("discard", uid, the_type, gid)
+            the_type == "waiting" and not glovar.user_ids[uid].waiting and glovar.waiting_ids.discard(uid)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Discard user {uid} status {the_type} error: {e}", exc_info=True)
+
+    return False
+
+
+def get_admin_groups() -> Dict[int, Set[int]]:
+    # Build the reverse admin index from the admin lists
+    result = {}
+
+    try:
+        for gid, uids in list(glovar.admin_ids.items()):
+            for uid in uids:
+                result.setdefault(uid, set()).add(gid)
+    except Exception as e:
+        logger.warning(f"Get admin groups error: {e}", exc_info=True)
+
+    return result
+
+
+def get_expiry_ids() -> List[Tuple[int, str, Union[int, str]]]:
+    # Build the expiry index from the calling messages and the reports
+    result = []
+
+    try:
+        for gid, (_, time) in list(glovar.message_ids.items()):
+            time and result.append((time, "message_ids", gid))
+
+        for key, report_record in list(glovar.reports.items()):
+            result.append((report_record["time"], "reports", key))
+
+        heapify(result)
+    except Exception as e:
+        logger.warning(f"Get expiry ids error: {e}", exc_info=True)
+
+    return result
+
+
+def get_report_users() -> Dict[int, int]:
+    # Build the reported users index from the reports
+    result = {}
+
+    try:
+        for report_record in list(glovar.reports.values()):
+            result[report_record["user_id"]] = result.get(report_record["user_id"], 0) + 1
+    except Exception as e:
+        logger.warning(f"Get report users error: {e}", exc_info=True)
+
+    return result
+
+
+def get_waiting_ids() -> Set[int]:
+    # Build the waiting index from the user data
+    result = set()
+
+    try:
+        if glovar.sqlite:
+            result = glovar.user_ids.get_uids("waiting")
+        else:
+            result = {uid for uid in list(glovar.user_ids) if glovar.user_ids[uid].waiting}
+    except Exception as e:
+        logger.warning(f"Get waiting ids error: {e}", exc_info=True)
+
+    return result
+
+
 def init_group_id(gid: int) -> bool:
     # Init group data
     try:
@@ -35,23 +215,23 @@ def init_group_id(gid: int) -> bool:
         if gid in glovar.left_group_ids:
             return False
 
-        if glovar.admin_ids.get(gid) is None:
-            glovar.admin_ids[gid] = set()
-            save("admin_ids")
+        with get_group_lock(gid):
+            if glovar.admin_ids.get(gid) is None:
+                update_admin_ids(gid, set())
 
-        if glovar.message_ids.get(gid) is None:
-            glovar.message_ids[gid] = (0, 0)
-            save("message_ids")
+            if glovar.message_ids.get(gid) is None:
+                glovar.message_ids[gid] = (0, 0)
+                save("message_ids")
 
-        if glovar.configs.get(gid) is None:
-            glovar.configs[gid] = deepcopy(glovar.default_config)
-            save("configs")
+            if glovar.configs.get(gid) is None:
+                glovar.configs[gid] = deepcopy(glovar.default_config)
+                save("configs")
 
-        if glovar.counts.get(gid) is None:
-            glovar.counts[gid] = {}
+            if glovar.counts.get(gid) is None:
+                glovar.counts[gid] = {}
 
-        if glovar.declared_message_ids.get(gid) is None:
-            glovar.declared_message_ids[gid] = set()
+            if glovar.declared_message_ids.get(gid) is None:
+                glovar.declared_message_ids[gid] = set()
 
         return True
     except Exception as e:
@@ -63,12 +243,210 @@ def init_group_id(gid: int) -> bool:
 def init_user_id(uid: int) -> bool:
     # Init user data
     try:
-        if glovar.user_ids.get(uid) is None:
-            glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-            save("user_ids")
+        with get_user_lock(uid):
+            if glovar.user_ids.get(uid) is None:
+                reset_user_id(uid)
 
         return True
     except Exception as e:
         logger.warning(f"Init user id {uid} error: {e}", exc_info=True)
 
     return False
+
+
+def lock_user(uid: int, gid: int) -> bool:
+    # Init the user data and lock the user in the group, return False if the user is already locked
+    try:
+        with get_user_lock(uid):
+            if not init_user_id(uid) or gid in glovar.user_ids[uid].lock:
+                return False
+
+            glovar.user_ids[uid].add("lock", gid)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Lock user {uid} error: {e}", exc_info=True)
+
+    return False
+
+
+def remove_admin_group(uid: int, gid: int) -> bool:
+    # Remove the group from the user's reverse admin index
+    try:
+        gids = glovar.admin_groups.get(uid)
+
+        if gids is None:
+            return True
+
+        gids.discard(gid)
+        gids or glovar.admin_groups.pop(uid, None)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Remove admin group error: {e}", exc_info=True)
+
+    return False
+
+
+def remove_admin_ids(gid: int) -> bool:
+    # Remove the group's admin list, keep the reverse admin index in sync
+    try:
+        for uid in glovar.admin_ids.pop(gid, set()):
+            remove_admin_group(uid, gid)
+
+        save("admin_ids")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Remove admin ids error: {e}", exc_info=True)
+
+    return False
+
+
+def remove_report(key: str) -> dict:
+    # Remove a report, keep the reported users index in sync
+    report_record = {}
+
+    try:
+        report_record = glovar.reports.pop(key, {})
+
+        if not report_record:
+            return {}
+
+        uid = report_record["user_id"]
+        count = glovar.report_users.get(uid, 0) - 1
+
+        if count > 0:
+            glovar.report_users[uid] = count
+        else:
+            glovar.report_users.pop(uid, 0)
+    except Exception as e:
+        logger.warning(f"Remove report error: {e}", exc_info=True)
+
+    return report_record
+
+
+def replace_user_ids(data: dict) -> bool:
+    # Replace all user data
+    try:
+        clear_user_ids()
+
+        for uid in data:
+            glovar.user_ids[uid] = get_user_status(data[uid])
+            journal("put", uid, glovar.user_ids[uid])
+            glovar.user_ids[uid].waiting and glovar.waiting_ids.add(uid)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Replace user ids error: {e}", exc_info=True)
+
+    return False
+
+
+def reset_user_id(uid: int) -> bool:
+    # Reset user data to the default status
+    try:
+        with get_user_lock(uid):
+            # The lock set belongs to the running actions, it is not part of the data
+            status = glovar.user_ids.get(uid)
+            new = UserStatus()
+            status is not None and status.lock and setattr(new, "lock", status.lock)
+            glovar.user_ids[uid] = new
+            journal("reset", uid)
+            glovar.waiting_ids.discard(uid)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Reset user id {uid} error: {e}", exc_info=True)
+
+    return False
+
+
+def unlock_user(uid: int, gid: int) -> bool:
+    # Unlock the user in the group
+    try:
+        with get_user_lock(uid):
+            status = glovar.user_ids.get(uid)
+            status is not None and status.discard("lock", gid)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Unlock user {uid} error: {e}", exc_info=True)
+
+    return False
+
+
+def update_admin_ids(gid: int, uids: Set[int]) -> bool:
+    # Replace the group's admin list, keep the reverse admin index in sync
+    try:
+        old = glovar.admin_ids.get(gid, set())
+
+        for uid in old - uids:
+            remove_admin_group(uid, gid)
+
+        for uid in uids - old:
+            glovar.admin_groups.setdefault(uid, set()).add(gid)
+
+        glovar.admin_ids[gid] = uids
+        save("admin_ids")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update admin ids error: {e}", exc_info=True)
+
+    return False
+
+
+def update_user_score(uid: int, project: str, score: float) -> bool:
+    # Update the user's score of the project
+    try:
+        with get_user_lock(uid):
+            glovar.user_ids[uid].set_score(project, score)
+            journal("score", uid, project, score)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update user {uid} score error: {e}", exc_info=True)
+
+    return False
+
+
+def update_user_scores(project: str, scores: Iterable[Tuple[int, float]]) -> bool:
+    # Update many users' scores of the project, the users of a lock stripe are updated together
+    try:
+        stripes: Dict[int, List[Tuple[int, float]]] = {}
+
+        for uid, score in scores:
+            stripes.setdefault(uid % glovar.lock_stripes, []).append((uid, score))
+
+        # Only one stripe is held at a time, its scores are journaled before it is released
+        for index, items in stripes.items():
+            with glovar.user_locks[index]:
+                ops = []
+
+                for uid, score in items:
+                    init_user_id(uid)
+                    glovar.user_ids[uid].set_score(project, score)
+                    ops.append(("score", uid, project, score))
+
+                journal_batch(ops)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update user scores error: {e}", exc_info=True)
+
+    return False
+
+
+def update_user_warn(uid: int, gid: int, count: int) -> bool:
+    # Update the user's warn count in the group, zero removes the record
+    try:
+        with get_user_lock(uid):
+            glovar.user_ids[uid].set_warn(gid, count)
+            journal("warn", uid, gid, count)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update user {uid} warn error: {e}", exc_info=True)
+
+    return False
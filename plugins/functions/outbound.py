@@ -0,0 +1,185 @@
+# SCP-079-WARN - Warn or ban someone by admin commands
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WARN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from concurrent.futures import Future
+from heapq import heappop, heappush
+from random import uniform
+from time import monotonic
+from typing import Any, Callable, Optional, Tuple, Union
+
+from pyrogram.errors import FloodWait
+
+from plugins import glovar
+from plugins.functions.etc import start_thread
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+def get_bucket_wait(key: int, now: float, need: float = 1.0) -> float:
+    # Get the secs until the bucket of a chat has the tokens needed, 0 is the global bucket
+    rate, capacity = get_rate(key)
+    tokens, updated = glovar.outbound_buckets.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    glovar.outbound_buckets[key] = (tokens, now)
+
+    return tokens >= need and 0.0 or (need - tokens) / rate
+
+
+def get_next_job() -> Tuple[int, Optional[tuple], Optional[float]]:
+    # Get the first request that may be sent now from the queues in priority order, or the time to look again
+    now = monotonic()
+    due = None
+
+    for priority, queue in enumerate(glovar.outbound_queues):
+        # Some workers are always left to the moderation and the evidence
+        if (priority >= glovar.outbound_exchange
+                and sum(glovar.outbound_busy[glovar.outbound_exchange:]) >= glovar.outbound_workers - 2):
+            break
+
+        while queue and queue[0][0] <= now:
+            _, count, job = heappop(queue)
+            wait = get_request_wait(job[0], job[1], get_pause_key(job[0], job[1], job[3]), priority, now)
+
+            if wait <= 0:
+                return count, job, None
+
+            heappush(queue, (now + wait, count, job))
+
+        if queue and (due is None or queue[0][0] < due):
+            due = queue[0][0]
+
+    return 0, None, due
+
+
+def get_pause_key(cid: int, send: bool, func: Callable) -> Union[int, str]:
+    # Get the key of the pause a request honours, the chat-less requests other than the sending are paused by method
+    return cid or (send and 0) or func.__name__
+
+
+def get_priority(cid: Union[int, str]) -> int:
+    # Get the priority of the requests in a chat, the requests in groups and private chats come first
+    if cid == glovar.debug_channel_id:
+        return glovar.outbound_debug
+
+    if cid in {glovar.exchange_channel_id, glovar.hide_channel_id}:
+        return glovar.outbound_exchange
+
+    if cid in {glovar.critical_channel_id, glovar.logging_channel_id, glovar.warn_channel_id}:
+        return glovar.outbound_evidence
+
+    return glovar.outbound_moderation
+
+
+def get_rate(key: int) -> Tuple[float, int]:
+    # Get the token rate per sec and the capacity of a bucket
+    return glovar.outbound_rates[(key == 0 and "global") or (key < 0 and "group") or "private"]
+
+
+def get_request_wait(cid: int, send: bool, key: Union[int, str], priority: int, now: float) -> float:
+    # Get the secs until a request may be sent, the tokens are taken if it may be sent now
+    wait = max(send and glovar.outbound_pauses.get(0, 0.0) or 0.0, glovar.outbound_pauses.get(key, 0.0)) - now
+
+    if wait > 0:
+        return wait
+
+    if not send:
+        return 0.0
+
+    # Refilled buckets and ended pauses are the same as missing ones
+    if len(glovar.outbound_buckets) > glovar.outbound_limit:
+        glovar.outbound_buckets = {key: (tokens, updated)
+                                   for key, (tokens, updated) in glovar.outbound_buckets.items()
+                                   if tokens + (now - updated) * get_rate(key)[0] < get_rate(key)[1]}
+        glovar.outbound_pauses = {key: due for key, due in glovar.outbound_pauses.items() if due > now}
+
+    # The exchange and debug traffic leaves some global tokens to the moderation
+    need = priority >= glovar.outbound_exchange and 1.0 + glovar.outbound_reserve or 1.0
+    wait = max(get_bucket_wait(0, now, need), cid and get_bucket_wait(cid, now) or 0.0)
+
+    if wait > 0:
+        return wait
+
+    for key in (cid and [0, cid] or [0]):
+        tokens, updated = glovar.outbound_buckets[key]
+        glovar.outbound_buckets[key] = (tokens - 1, updated)
+
+    return 0.0
+
+
+def request(cid: int, send: bool, func: Callable, *args: Any, **kwargs: Any) -> Any:
+    # Run an API request in the outbound workers and return its result, FloodWait is handled by the workers
+    future = Future()
+    priority = get_priority(cid)
+
+    with glovar.outbound_condition:
+        queue = glovar.outbound_queues[priority]
+
+        # The debug traffic is shed under backpressure
+        if priority == glovar.outbound_debug and len(queue) >= glovar.outbound_shed:
+            logger.warning(f"Request in {cid} - Shed, {len(queue)} debug request(s) are queued")
+            return None
+
+        glovar.outbound_count += 1
+        heappush(queue, (monotonic(), glovar.outbound_count, (cid, send, priority, func, args, kwargs, future)))
+
+        while glovar.outbound_started < glovar.outbound_workers:
+            glovar.outbound_started += 1
+            start_thread(request_loop, ())
+
+        glovar.outbound_condition.notify()
+
+    return future.result()
+
+
+def request_loop() -> bool:
+    # Send the queued requests that are allowed by the pauses and the token buckets, by priority
+    while True:
+        try:
+            with glovar.outbound_condition:
+                count, job, due = get_next_job()
+
+                while not job:
+                    glovar.outbound_condition.wait(due and max(due - monotonic(), 0.001))
+                    count, job, due = get_next_job()
+
+                glovar.outbound_busy[job[2]] += 1
+
+            cid, send, priority, func, args, kwargs, future = job
+
+            try:
+                future.set_result(func(*args, **kwargs))
+            except FloodWait as e:
+                # Pause the chat, or the method if the flood is not about a chat, then send it again
+                key = get_pause_key(cid, send, func)
+                logger.warning(f"Request in {key} - Pause for {e.x} second(s)")
+
+                with glovar.outbound_condition:
+                    due = monotonic() + e.x + uniform(0.5, 1.0)
+                    glovar.outbound_pauses[key] = max(glovar.outbound_pauses.get(key, 0.0), due)
+                    heappush(glovar.outbound_queues[priority], (due, count, job))
+                    glovar.outbound_condition.notify()
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with glovar.outbound_condition:
+                    glovar.outbound_busy[priority] -= 1
+                    glovar.outbound_condition.notify()
+        except Exception as e:
+            logger.warning(f"Request loop error: {e}", exc_info=True)
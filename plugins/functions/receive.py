@@ -18,7 +18,6 @@
 
 import logging
 import pickle
-from copy import deepcopy
 from json import loads
 from typing import Any
 
@@ -27,14 +26,20 @@ from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 from plugins import glovar
 from plugins.functions.channel import get_debug_text, share_data
-from plugins.functions.etc import code, crypt_str, general_link, get_int, get_text, lang, mention_id, thread
+from plugins.functions.codec import decode, is_encoded
+from plugins.functions.etc import code, crypt_str, general_link, get_group_lock, get_int, get_text, get_user_lock, lang
+from plugins.functions.etc import mention_id, thread
 from plugins.functions.file import crypt_file, data_to_file, delete_file, get_downloaded_path, get_new_path, save
 from plugins.functions.filters import is_declared_message_id
-from plugins.functions.group import get_config_text, get_message, leave_group
-from plugins.functions.ids import init_group_id, init_user_id
-from plugins.functions.telegram import send_message, send_report_message
+from plugins.functions.group import get_config_text, get_message, leave_group, send_report_message
+from plugins.functions.ids import clear_user_ids, get_admin_groups, get_expiry_ids, get_report_users, get_waiting_ids
+from plugins.functions.ids import init_group_id, init_user_id, replace_user_ids, reset_user_id
+from plugins.functions.ids import update_user_score, update_user_scores
+from plugins.functions.store import replace
+from plugins.functions.telegram import send_message
 from plugins.functions.timers import update_admins
 from plugins.functions.user import report_user
+from plugins.functions.wire import get_wire_data
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -80,21 +85,17 @@ def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
         # Clear user data
         if data_type == "user":
             if the_type == "all":
-                glovar.user_ids = {}
-
-            save("user_ids")
+                clear_user_ids()
 
         # Clear watch data
         if data_type == "watch":
             if the_type == "all":
-                glovar.watch_ids = {
-                    "ban": {},
-                    "delete": {}
-                }
+                glovar.watch_ids["ban"].clear()
+                glovar.watch_ids["delete"].clear()
             elif the_type == "ban":
-                glovar.watch_ids["ban"] = {}
+                glovar.watch_ids["ban"].clear()
             elif the_type == "delete":
-                glovar.watch_ids["delete"] = {}
+                glovar.watch_ids["delete"].clear()
 
             save("watch_ids")
 
@@ -210,8 +211,8 @@ def receive_declared_message(data: dict) -> bool:
         if not glovar.admin_ids.get(gid):
             return True
 
-        if init_group_id(gid):
-            glovar.declared_message_ids[gid].add(mid)
+        with get_group_lock(gid):
+            init_group_id(gid) and glovar.declared_message_ids[gid].add(mid)
 
         return True
     except Exception as e:
@@ -244,7 +245,10 @@ def receive_file_data(client: Client, message: Message, decrypt: bool = True) ->
             path_final = path
 
         with open(path_final, "rb") as f:
-            data = pickle.load(f)
+            raw = f.read()
+
+        # Other bots still send pickled data
+        data = decode(raw) if is_encoded(raw) else pickle.loads(raw)
 
         for f in {path, path_decrypted}:
             thread(delete_file, (f,))
@@ -277,9 +281,9 @@ def receive_help_report(client: Client, data: dict) -> bool:
             return True
 
         if not (init_user_id(0) and init_user_id(uid)
-                and gid not in glovar.user_ids[uid]["lock"]
-                and gid not in glovar.user_ids[uid]["waiting"]
-                and gid not in glovar.user_ids[uid]["ban"]):
+                and gid not in glovar.user_ids[uid].lock
+                and gid not in glovar.user_ids[uid].waiting
+                and gid not in glovar.user_ids[uid].ban):
             return True
 
         the_message = get_message(client, gid, mid)
@@ -373,8 +377,7 @@ def receive_remove_bad(data: dict) -> bool:
             glovar.watch_ids["ban"].pop(the_id, {})
             glovar.watch_ids["delete"].pop(the_id, {})
             save("watch_ids")
-            glovar.user_ids[the_id] = deepcopy(glovar.default_user_status)
-            save("user_ids")
+            reset_user_id(the_id)
 
         save("bad_ids")
 
@@ -387,22 +390,19 @@ def receive_remove_bad(data: dict) -> bool:
 
 def receive_remove_score(data: int) -> bool:
     # Receive remove user's score
-    glovar.locks["message"].acquire()
     try:
         # Basic data
         uid = data
 
-        if not glovar.user_ids.get(uid):
-            return True
+        with get_user_lock(uid):
+            if not glovar.user_ids.get(uid):
+                return True
 
-        glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-        save("user_ids")
+            reset_user_id(uid)
 
         return True
     except Exception as e:
         logger.warning(f"Receive remove score error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
@@ -436,8 +436,24 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
         if not the_data:
             return True
 
-        exec(f"glovar.{the_type} = the_data")
-        save(the_type)
+        if the_type == "user_ids":
+            replace_user_ids(the_data)
+        elif glovar.sqlite and the_type in glovar.sqlite_list:
+            replace(eval(f"glovar.{the_type}"), the_data)
+            save(the_type)
+        else:
+            exec(f"glovar.{the_type} = the_data")
+            save(the_type)
+
+        # Rebuild the indexes of the rolled back data
+        if the_type == "admin_ids":
+            glovar.admin_groups = get_admin_groups()
+        elif the_type in {"message_ids", "reports"}:
+            with glovar.locks["message"]:
+                glovar.expiry_ids = get_expiry_ids()
+                glovar.report_users = get_report_users()
+        elif the_type == "user_ids":
+            glovar.waiting_ids = get_waiting_ids()
 
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
@@ -451,8 +467,8 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
     return False
 
 
-def receive_text_data(message: Message) -> dict:
-    # Receive text's data from exchange channel
+def receive_text_data(message: Message, receiver: str = "") -> dict:
+    # Receive text's data from exchange channel, the text that does not mention the receiver is not decoded
     data = {}
     try:
         text = get_text(message)
@@ -460,6 +476,14 @@ def receive_text_data(message: Message) -> dict:
         if not text:
             return {}
 
+        data, compact = get_wire_data(text, receiver)
+
+        if compact:
+            return data
+
+        if receiver and f'"{receiver}"' not in text:
+            return {}
+
         data = loads(text)
     except Exception as e:
         logger.warning(f"Receive text data error: {e}")
@@ -469,24 +493,42 @@ def receive_text_data(message: Message) -> dict:
 
 def receive_user_score(project: str, data: dict) -> bool:
     # Receive and update user's score
-    glovar.locks["message"].acquire()
     try:
         # Basic data
         project = project.lower()
         uid = data["id"]
+        score = data["score"]
+
+        with get_user_lock(uid):
+            init_user_id(uid) and update_user_score(uid, project, score)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Receive user score error: {e}", exc_info=True)
+
+    return False
+
 
-        if not init_user_id(uid):
+def receive_user_scores(client: Client, message: Message, project: str, data: Any) -> bool:
+    # Receive and update a batch of users' scores, big batches are sent as files
+    try:
+        # Basic data
+        project = project.lower()
+
+        if not isinstance(data, list):
+            data = receive_file_data(client, message)
+
+        if not data:
             return True
 
-        score = data["score"]
-        glovar.user_ids[uid]["score"][project] = score
-        save("user_ids")
+        # The records are [uid, score], or [uid, project, score] that only the project itself may send
+        scores = [(int(record[0]), float(record[-1])) for record in data
+                  if len(record) == 2 or (len(record) == 3 and record[1] == project)]
+        update_user_scores(project, scores)
 
         return True
     except Exception as e:
-        logger.warning(f"Receive user score error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
+        logger.warning(f"Receive user scores error: {e}", exc_info=True)
 
     return False
 
@@ -0,0 +1,203 @@
+# SCP-079-WARN - Warn or ban someone by admin commands
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WARN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module is imported by glovar, so it must not import glovar
+
+import logging
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from os import O_RDONLY, close, fsync, open as open_fd, replace
+from os.path import dirname, exists
+from struct import Struct
+from typing import Any, BinaryIO, Dict, List, Tuple
+from zlib import crc32
+
+from plugins.functions.codec import decode, encode
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Magic, payload format, generation, payload CRC32, payload length
+header = Struct("<4sHQII")
+magic = b"S079"
+format_pickle = 1
+format_codec = 2
+
+# Magic, payload CRC32, payload length
+record_header = Struct("<4sII")
+record_magic = b"J079"
+
+
+def get_shard(file: str, index: int) -> str:
+    # Get the name of a shard of a file
+    return f"{file}/{index:03d}"
+
+
+def get_slots(file: str) -> List[str]:
+    # Get the two snapshot slots of a file, generations alternate between them
+    head, _, tail = f"data/{file}".rpartition("/")
+    return [f"{head}/{tail}", f"{head}/.{tail}"]
+
+
+def load_shards(file: str, count: int) -> Tuple[Dict[str, int], dict]:
+    # Load the shards of a file in parallel, return ({shard: generation}, merged data)
+    names = [get_shard(file, index) for index in range(count)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(load_snapshot, names))
+
+    generations = {}
+    data = {}
+
+    for name, (generation, shard) in zip(names, results):
+        if generation < 0:
+            continue
+
+        generations[name] = generation
+        data.update(shard)
+
+    return generations, data
+
+
+def load_snapshot(file: str) -> Tuple[int, Any]:
+    # Load the newest valid snapshot of a file, return (generation, data), generation is -1 if none exists
+    snapshots = [read_snapshot(path) for path in get_slots(file)]
+    snapshots = sorted((s for s in snapshots if s[0] > 0), key=lambda s: s[0], reverse=True)
+
+    # A slot that passes the checksum but fails to decode falls back to the older slot
+    for generation, the_format, payload in snapshots:
+        try:
+            if the_format == format_pickle:
+                return generation, pickle.loads(payload)
+
+            return generation, decode(payload)
+        except Exception as e:
+            logger.error(f"Decode snapshot {file} generation {generation} error: {e}", exc_info=True)
+
+    if snapshots:
+        raise ValueError(f"no decodable snapshot of {file}")
+
+    # Snapshots written before the header was added are plain pickles, the primary is tried first
+    for path in get_slots(file):
+        try:
+            if exists(path):
+                with open(path, "rb") as f:
+                    return 0, pickle.load(f)
+        except Exception as e:
+            logger.error(f"Load legacy data {path} error: {e}", exc_info=True)
+
+    if any(exists(path) for path in get_slots(file)):
+        raise ValueError(f"no valid snapshot of {file}")
+
+    return -1, None
+
+
+def read_record(f: BinaryIO) -> Any:
+    # Read a record appended by write_record, older journals contain pickled records
+    position = f.tell()
+    head = f.read(record_header.size)
+
+    if not head:
+        raise EOFError
+
+    if head[:4] != record_magic:
+        f.seek(position)
+        return pickle.load(f)
+
+    if len(head) < record_header.size:
+        raise ValueError("incomplete record header")
+
+    _, checksum, length = record_header.unpack(head)
+    payload = f.read(length)
+
+    if len(payload) != length or crc32(payload) != checksum:
+        raise ValueError("incomplete record")
+
+    return decode(payload)
+
+
+def read_snapshot(path: str) -> Tuple[int, int, bytes]:
+    # Read and verify a snapshot, return (generation, format, payload), generation is 0 if invalid
+    try:
+        if not exists(path):
+            return 0, 0, b""
+
+        with open(path, "rb") as f:
+            head = f.read(header.size)
+
+            if len(head) < header.size or head[:4] != magic:
+                return 0, 0, b""
+
+            _, the_format, generation, checksum, length = header.unpack(head)
+            payload = f.read(length)
+
+        if len(payload) != length or crc32(payload) != checksum:
+            logger.warning(f"Snapshot {path} generation {generation} is corrupted")
+            return 0, 0, b""
+
+        return generation, the_format, payload
+    except Exception as e:
+        logger.warning(f"Read snapshot {path} error: {e}", exc_info=True)
+
+    return 0, 0, b""
+
+
+def split_shards(data: dict, count: int) -> List[dict]:
+    # Split a dict with int keys into shards
+    shards = [{} for _ in range(count)]
+
+    for key, value in data.items():
+        shards[key % count][key] = value
+
+    return shards
+
+
+def write_record(f: BinaryIO, data: Any) -> bool:
+    # Append a checksummed record to a file
+    payload = encode(data)
+    f.write(record_header.pack(record_magic, crc32(payload), len(payload)) + payload)
+
+    return True
+
+
+def write_snapshot(file: str, generation: int, data: Any) -> bool:
+    # Write a snapshot to a temp file, then atomically replace the older slot with it
+    path = get_slots(file)[generation % 2]
+    temp = f"{path}.tmp"
+    payload = encode(data)
+
+    with open(temp, "wb") as f:
+        f.write(header.pack(magic, format_codec, generation, crc32(payload), len(payload)))
+        f.write(payload)
+        f.flush()
+        fsync(f.fileno())
+
+    replace(temp, path)
+
+    # Make the rename itself durable
+    try:
+        fd = open_fd(dirname(path) or ".", O_RDONLY)
+
+        try:
+            fsync(fd)
+        finally:
+            close(fd)
+    except OSError:
+        pass
+
+    return True
@@ -0,0 +1,190 @@
+# SCP-079-WARN - Warn or ban someone by admin commands
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WARN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module is imported by glovar, so it must not import glovar
+
+import logging
+from array import array
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Union
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# The projects that send scores, in the order of the score array, the total is kept after them
+projects = ("captcha", "clean", "lang", "long", "noflood", "noporn", "nospam", "recheck", "warn")
+project_index: Dict[str, int] = {project: i for i, project in enumerate(projects)}
+total_index = len(projects)
+
+# The group sets of a user
+set_types = ("ban", "kick", "lock", "waiting")
+
+# Shared by all the users that have nothing in a set or dict
+empty_set: FrozenSet[int] = frozenset()
+empty_dict = MappingProxyType({})
+
+
+class UserStatus:
+    # A user's status, the sets, the dict and the score array are created on first write
+    __slots__ = ("ban", "kick", "lock", "waiting", "score", "warn")
+
+    def __init__(self):
+        self.ban: Union[FrozenSet[int], Set[int]] = empty_set
+        self.kick: Union[FrozenSet[int], Set[int]] = empty_set
+        self.lock: Union[FrozenSet[int], Set[int]] = empty_set
+        self.waiting: Union[FrozenSet[int], Set[int]] = empty_set
+        self.score: Optional[array] = None
+        self.warn: Union[MappingProxyType, Dict[int, int]] = empty_dict
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is UserStatus and self.to_tuple() == other.to_tuple()
+
+    def __getstate__(self) -> tuple:
+        return self.to_tuple()
+
+    def __setstate__(self, state: tuple) -> None:
+        self.__init__()
+        self.set_tuple(state)
+
+    def __repr__(self) -> str:
+        return f"UserStatus{self.to_tuple()}"
+
+    def add(self, the_type: str, gid: int) -> None:
+        # Add a group to a set
+        values = getattr(self, the_type)
+
+        if values is empty_set:
+            setattr(self, the_type, {gid})
+        else:
+            values.add(gid)
+
+    def clear(self, the_type: str) -> None:
+        # Clear a set
+        setattr(self, the_type, empty_set)
+
+    def copy(self) -> "UserStatus":
+        # Get a copy that shares no set, dict or array with the status
+        status = UserStatus()
+        status.set_tuple(self.to_tuple())
+
+        return status
+
+    def discard(self, the_type: str, gid: int) -> None:
+        # Discard a group from a set
+        values = getattr(self, the_type)
+
+        if gid not in values:
+            return
+
+        values.discard(gid)
+        values or setattr(self, the_type, empty_set)
+
+    def get_score(self, project: str) -> float:
+        # Get a project's score
+        if self.score is None or project not in project_index:
+            return 0.0
+
+        return self.score[project_index[project]]
+
+    def get_scores(self) -> List[float]:
+        # Get all the scores in the project order
+        if self.score is None:
+            return [0.0] * len(projects)
+
+        return self.score[:total_index].tolist()
+
+    def get_total(self) -> float:
+        # Get the total score
+        if self.score is None:
+            return 0.0
+
+        return self.score[total_index]
+
+    def set_score(self, project: str, score: float) -> None:
+        # Set a project's score, scores of unknown projects are ignored
+        if project not in project_index:
+            return
+
+        if self.score is None:
+            if not score:
+                return
+
+            self.score = array("f", bytes(4 * (total_index + 1)))
+
+        self.score[project_index[project]] = score
+        self.score[total_index] = sum(self.score[:total_index])
+
+    def set_tuple(self, values: tuple) -> None:
+        # Set the status from the values of to_tuple
+        ban, kick, lock, waiting, scores, warn = values
+
+        for the_type, gids in zip(set_types, (ban, kick, lock, waiting)):
+            gids and setattr(self, the_type, set(gids))
+
+        if scores and any(scores):
+            self.score = array("f", scores)
+            self.score.append(sum(self.score))
+
+        if warn:
+            self.warn = dict(warn)
+
+    def set_warn(self, gid: int, count: int) -> None:
+        # Set the warn count in a group, the group is removed if the count is not positive
+        if count > 0 and self.warn is empty_dict:
+            self.warn = {gid: count}
+        elif count > 0:
+            self.warn[gid] = count
+        elif gid in self.warn:
+            self.warn.pop(gid, 0)
+            self.warn or setattr(self, "warn", empty_dict)
+
+    def to_dict(self) -> dict:
+        # Get the status as a plain dict
+        return {
+            "ban": set(self.ban),
+            "kick": set(self.kick),
+            "lock": set(self.lock),
+            "score": dict(zip(projects, self.get_scores())),
+            "warn": dict(self.warn),
+            "waiting": set(self.waiting)
+        }
+
+    def to_tuple(self) -> tuple:
+        # Get the status as a tuple of builtin values
+        return (list(self.ban), list(self.kick), list(self.lock), list(self.waiting),
+                self.score is not None and self.get_scores() or None, dict(self.warn))
+
+
+def get_user_status(record: Any) -> UserStatus:
+    # Get a UserStatus from a status or a record dict of older versions
+    if type(record) is UserStatus:
+        return record
+
+    status = UserStatus()
+
+    for the_type in set_types:
+        for gid in record.get(the_type, ()):
+            status.add(the_type, gid)
+
+    for project, score in record.get("score", {}).items():
+        status.set_score(project, score)
+
+    for gid, count in record.get("warn", {}).items():
+        status.set_warn(gid, count)
+
+    return status
@@ -0,0 +1,384 @@
+# SCP-079-WARN - Warn or ban someone by admin commands
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WARN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module is imported by glovar, so it must not import glovar
+
+import logging
+import pickle
+import sqlite3
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from threading import Lock, RLock
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from plugins.functions.status import UserStatus, get_user_status, projects, set_types
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class Store:
+    # The SQLite database shared by all tables
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.lock = Lock()
+
+    def execute(self, sql: str, params: Iterable = ()) -> list:
+        # Run a single statement
+        with self.lock:
+            return self.conn.execute(sql, tuple(params)).fetchall()
+
+    def transaction(self, statements: List[tuple]) -> bool:
+        # Run (sql, params_list) statements in one transaction, the same sql is prepared only once
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN")
+
+                for sql, params_list in statements:
+                    self.conn.executemany(sql, params_list)
+
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        return True
+
+
+class SQLiteDict(MutableMapping):
+    # A dict-like table, values are kept in memory once read, and written back by commit
+    def __init__(self, store: Store, table: str, scope: str = ""):
+        self.store = store
+        self.table = table
+        self.scope = scope
+        self.cache: Dict[Any, Any] = {}
+        self.written: Dict[Any, bytes] = {}
+        self.deleted: Set[Any] = set()
+        self.cleared = False
+        self.lock = Lock()
+
+        store.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                      f"(scope TEXT NOT NULL, key NOT NULL, value BLOB NOT NULL, PRIMARY KEY (scope, key))")
+
+    def __getitem__(self, key: Any) -> Any:
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+
+            if self.cleared or key in self.deleted:
+                raise KeyError(key)
+
+            rows = self.store.execute(f"SELECT value FROM {self.table} WHERE scope = ? AND key = ?",
+                                      (self.scope, key))
+
+            if not rows:
+                raise KeyError(key)
+
+            value = pickle.loads(rows[0][0])
+            self.cache[key] = value
+            self.written[key] = rows[0][0]
+
+            return value
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        with self.lock:
+            self.cache[key] = value
+            self.deleted.discard(key)
+
+    def __delitem__(self, key: Any) -> None:
+        self[key]
+
+        with self.lock:
+            self.cache.pop(key, None)
+            self.written.pop(key, None)
+            self.deleted.add(key)
+
+    def __iter__(self) -> Iterator:
+        with self.lock:
+            if self.cleared:
+                keys = set(self.cache)
+            else:
+                rows = self.store.execute(f"SELECT key FROM {self.table} WHERE scope = ?", (self.scope,))
+                keys = ({row[0] for row in rows} | set(self.cache)) - self.deleted
+
+        return iter(list(keys))
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache = {}
+            self.written = {}
+            self.deleted = set()
+            self.cleared = True
+
+    def commit(self) -> bool:
+        # Write the changed values back
+        with self.lock:
+            statements = []
+
+            if self.cleared:
+                statements.append((f"DELETE FROM {self.table} WHERE scope = ?", [(self.scope,)]))
+
+            if self.deleted:
+                statements.append((f"DELETE FROM {self.table} WHERE scope = ? AND key = ?",
+                                   [(self.scope, key) for key in self.deleted]))
+
+            rows = []
+
+            for key, value in self.cache.items():
+                data = pickle.dumps(value)
+
+                if self.written.get(key) == data:
+                    continue
+
+                self.written[key] = data
+                rows.append((self.scope, key, data))
+
+            if rows:
+                statements.append((f"INSERT OR REPLACE INTO {self.table} (scope, key, value) VALUES (?, ?, ?)", rows))
+
+            statements and self.store.transaction(statements)
+            self.deleted = set()
+            self.cleared = False
+
+        return True
+
+    def export(self) -> dict:
+        # Get a plain dict copy
+        return {key: self[key] for key in self}
+
+
+class UserDict(MutableMapping):
+    # The dict-like user_ids table, changes are written by applying the journal operations
+    def __init__(self, store: Store, size: int, stripes: List[RLock]):
+        self.store = store
+        self.projects = projects
+        self.size = size
+        self.stripes = stripes
+        self.cache: OrderedDict = OrderedDict()
+        self.drops = 0
+        self.lock = Lock()
+
+        scores = "".join(f", {project} REAL NOT NULL DEFAULT 0" for project in self.projects)
+        store.execute(f"CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY{scores})")
+        store.execute("CREATE TABLE IF NOT EXISTS user_groups "
+                      "(user_id INTEGER NOT NULL, group_id INTEGER NOT NULL, type TEXT NOT NULL, "
+                      "value INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (user_id, group_id, type))")
+        store.execute("CREATE INDEX IF NOT EXISTS user_groups_group ON user_groups (group_id, type)")
+
+    def __getitem__(self, uid: int) -> UserStatus:
+        with self.lock:
+            if uid in self.cache:
+                self.cache.move_to_end(uid)
+                return self.cache[uid]
+
+            if self.drops:
+                raise KeyError(uid)
+
+        record = self.load(uid)
+
+        if record is None:
+            raise KeyError(uid)
+
+        with self.lock:
+            return self.cache.setdefault(uid, record)
+
+    def __setitem__(self, uid: int, record: UserStatus) -> None:
+        with self.lock:
+            self.cache[uid] = record
+            self.cache.move_to_end(uid)
+
+    def __delitem__(self, uid: int) -> None:
+        self[uid]
+
+        with self.lock:
+            self.cache.pop(uid, None)
+            self.store.transaction(self.get_statements([("delete", uid)]))
+
+    def __iter__(self) -> Iterator:
+        with self.lock:
+            if self.drops:
+                uids = set(self.cache)
+            else:
+                uids = {row[0] for row in self.store.execute("SELECT user_id FROM users")} | set(self.cache)
+
+        return iter(list(uids))
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    def clear(self) -> None:
+        # The rows are deleted when the matching drop operation is applied
+        with self.lock:
+            self.cache = OrderedDict()
+            self.drops += 1
+
+    def apply(self, ops: List[tuple], pending: Set[int]) -> bool:
+        # Apply the journal operations, then evict the least recently used records that no flow is using
+        drops = sum(op[0] == "drop" for op in ops)
+        self.store.transaction(self.get_statements(ops))
+
+        with self.lock:
+            self.drops -= min(drops, self.drops)
+
+            for uid in list(self.cache):
+                if len(self.cache) <= self.size:
+                    break
+
+                # The lock set is not journaled, and a record in use is skipped instead of waiting for its stripe
+                if uid in pending or self.cache[uid].lock:
+                    continue
+
+                stripe = self.stripes[uid % len(self.stripes)]
+
+                if not stripe.acquire(blocking=False):
+                    continue
+
+                try:
+                    self.cache.pop(uid, None)
+                finally:
+                    stripe.release()
+
+        return True
+
+    def export(self) -> dict:
+        # Get a plain dict copy
+        return {uid: self[uid] for uid in self}
+
+    def get_statements(self, ops: List[tuple]) -> List[tuple]:
+        # Convert the journal operations to SQL statements
+        statements = []
+
+        for op, uid, *args in ops:
+            if op == "drop":
+                statements.append(("DELETE FROM users", [()]))
+                statements.append(("DELETE FROM user_groups", [()]))
+                continue
+
+            if op in {"delete", "put", "reset"}:
+                statements.append(("DELETE FROM users WHERE user_id = ?", [(uid,)]))
+                statements.append(("DELETE FROM user_groups WHERE user_id = ?", [(uid,)]))
+
+                if op == "delete":
+                    continue
+
+            if op == "put":
+                record = get_user_status(args[0])
+                columns = "".join(f", {project}" for project in self.projects)
+                marks = ", ?" * len(self.projects)
+                scores = tuple(record.get_scores())
+                statements.append((f"INSERT INTO users (user_id{columns}) VALUES (?{marks})", [(uid,) + scores]))
+                statements.append(("INSERT OR REPLACE INTO user_groups (user_id, group_id, type, value) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   [(uid, gid, the_type, 0)
+                                    for the_type in ("ban", "kick", "waiting") for gid in getattr(record, the_type)]
+                                   + [(uid, gid, "warn", count) for gid, count in record.warn.items()]))
+                continue
+
+            statements.append(("INSERT OR IGNORE INTO users (user_id) VALUES (?)", [(uid,)]))
+
+            if op == "add":
+                statements.append(("INSERT OR IGNORE INTO user_groups (user_id, group_id, type) VALUES (?, ?, ?)",
+                                   [(uid, args[1], args[0])]))
+            elif op == "clear":
+                statements.append(("DELETE FROM user_groups WHERE user_id = ? AND type = ?", [(uid, args[0])]))
+            elif op == "discard":
+                statements.append(("DELETE FROM user_groups WHERE user_id = ? AND group_id = ? AND type = ?",
+                                   [(uid, args[1], args[0])]))
+            elif op == "score" and args[0] in self.projects:
+                statements.append((f"UPDATE users SET {args[0]} = ? WHERE user_id = ?", [(args[1], uid)]))
+            elif op == "warn" and args[1] > 0:
+                statements.append(("INSERT OR REPLACE INTO user_groups (user_id, group_id, type, value) "
+                                   "VALUES (?, ?, 'warn', ?)", [(uid, args[0], args[1])]))
+            elif op == "warn":
+                statements.append(("DELETE FROM user_groups WHERE user_id = ? AND group_id = ? AND type = 'warn'",
+                                   [(uid, args[0])]))
+
+        return statements
+
+    def get_uids(self, the_type: str) -> Set[int]:
+        # Get the users that have any group in a status set
+        with self.lock:
+            uids = {uid for uid, record in self.cache.items() if getattr(record, the_type)}
+
+            if not self.drops:
+                uids |= {row[0] for row in self.store.execute("SELECT DISTINCT user_id FROM user_groups "
+                                                              "WHERE type = ?", (the_type,))
+                         if row[0] not in self.cache}
+
+        return uids
+
+    def load(self, uid: int) -> Optional[UserStatus]:
+        # Read a user's record from the database
+        rows = self.store.execute(f"SELECT {', '.join(self.projects)} FROM users WHERE user_id = ?", (uid,))
+
+        if not rows:
+            return None
+
+        record = UserStatus()
+
+        for project, score in zip(self.projects, rows[0]):
+            record.set_score(project, score)
+
+        for gid, the_type, value in self.store.execute("SELECT group_id, type, value FROM user_groups "
+                                                        "WHERE user_id = ?", (uid,)):
+            if the_type == "warn":
+                record.set_warn(gid, value)
+            elif the_type in set_types:
+                record.add(the_type, gid)
+
+        return record
+
+
+def commit(data: Any) -> bool:
+    # Commit a table, or a dict of tables, user_ids is written by applying the journal operations
+    if isinstance(data, SQLiteDict):
+        return data.commit()
+
+    if isinstance(data, UserDict):
+        return True
+
+    for table in data.values():
+        commit(table)
+
+    return True
+
+
+def replace(table: Any, data: dict) -> bool:
+    # Replace the contents of a table, or a dict of tables
+    if isinstance(table, SQLiteDict):
+        table.clear()
+        table.update(data)
+        return True
+
+    for key in data:
+        replace(table[key], data[key])
+
+    return True
+
+
+def export(data: Any) -> Any:
+    # Get a plain copy of a table, or a dict of tables
+    if isinstance(data, (SQLiteDict, UserDict)):
+        return data.export()
+
+    return {key: export(value) for key, value in data.items()}
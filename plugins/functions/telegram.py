@@ -28,8 +28,9 @@ from pyrogram.errors import MessageDeleteForbidden, PeerIdInvalid, QueryIdInvali
 from pyrogram.errors import ButtonUrlInvalid, ReplyMarkupInvalid
 
 from plugins import glovar
-from plugins.functions.decorators import retry, threaded
-from plugins.functions.etc import delay, get_int, t2t, wait_flood
+from plugins.functions.decorators import retry
+from plugins.functions.etc import get_int, t2t, thread
+from plugins.functions.outbound import request
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -39,20 +40,14 @@ def answer_callback(client: Client, callback_query_id: str, text: str, show_aler
     # Answer the callback
     result = None
     try:
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                result = client.answer_callback_query(
-                    callback_query_id=callback_query_id,
-                    text=text,
-                    show_alert=show_alert
-                )
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
-            except QueryIdInvalid:
-                return False
+        result = request(
+            0, False, client.answer_callback_query,
+            callback_query_id=callback_query_id,
+            text=text,
+            show_alert=show_alert
+        )
+    except QueryIdInvalid:
+        return False
     except Exception as e:
         logger.warning(f"Answer query to {callback_query_id} error: {e}", exc_info=True)
 
@@ -67,14 +62,7 @@ def delete_messages(client: Client, cid: int, mids: Iterable[int]) -> Optional[b
         mids_list = [mids[i:i + 100] for i in range(0, len(mids), 100)]
         for mids in mids_list:
             try:
-                flood_wait = True
-                while flood_wait:
-                    flood_wait = False
-                    try:
-                        result = client.delete_messages(chat_id=cid, message_ids=mids)
-                    except FloodWait as e:
-                        flood_wait = True
-                        wait_flood(e)
+                result = request(cid, False, client.delete_messages, chat_id=cid, message_ids=mids)
             except MessageDeleteForbidden:
                 return False
             except Exception as e:
@@ -109,32 +97,25 @@ def edit_message_text(client: Client, cid: int, mid: int, text: str,
         if not text.strip():
             return None
 
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                result = client.edit_message_text(
-                    chat_id=cid,
-                    message_id=mid,
-                    text=text,
-                    parse_mode="html",
-                    disable_web_page_preview=True,
-                    reply_markup=markup
-                )
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
-            except ButtonDataInvalid:
-                logger.warning(f"Edit message {mid} text in {cid} - invalid markup: {markup}")
-            except (ChatAdminRequired, PeerIdInvalid, ChannelInvalid, ChannelPrivate):
-                return False
+        result = request(
+            cid, True, client.edit_message_text,
+            chat_id=cid,
+            message_id=mid,
+            text=text,
+            parse_mode="html",
+            disable_web_page_preview=True,
+            reply_markup=markup
+        )
+    except ButtonDataInvalid:
+        logger.warning(f"Edit message {mid} text in {cid} - invalid markup: {markup}")
+    except (ChatAdminRequired, PeerIdInvalid, ChannelInvalid, ChannelPrivate):
+        return False
     except Exception as e:
         logger.warning(f"Edit message {mid} in {cid} error: {e}", exc_info=True)
 
     return result
 
 
-@retry
 def get_admins(client: Client, cid: int) -> Union[bool, List[ChatMember], None]:
     # Get a group's admins
     result = None
@@ -145,9 +126,7 @@ def get_admins(client: Client, cid: int) -> Union[bool, List[ChatMember], None]:
         if isinstance(chat, Chat) and not chat.members_count:
             return False
 
-        result = client.get_chat_members(chat_id=cid, filter="administrators")
-    except FloodWait as e:
-        raise e
+        result = request(cid, False, client.get_chat_members, chat_id=cid, filter="administrators")
     except (AttributeError, ChannelInvalid, ChannelPrivate, PeerIdInvalid):
         return False
     except Exception as e:
@@ -160,16 +139,9 @@ def get_chat(client: Client, cid: Union[int, str]) -> Union[Chat, ChatPreview, N
     # Get a chat
     result = None
     try:
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                result = client.get_chat(chat_id=cid)
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
-            except (PeerIdInvalid, ChannelInvalid, ChannelPrivate):
-                return None
+        result = request(cid, False, client.get_chat, chat_id=cid)
+    except (PeerIdInvalid, ChannelInvalid, ChannelPrivate):
+        return None
     except Exception as e:
         logger.warning(f"Get chat {cid} error: {e}", exc_info=True)
 
@@ -184,12 +156,14 @@ def get_group_info(client: Client, chat: Union[int, Chat], cache: bool = True) -
         if isinstance(chat, int):
             the_cache = glovar.chats.get(chat)
             if the_cache:
+                # A hot group is fetched again in the background before it expires
+                glovar.chats.should_refresh(chat) and thread(refresh_chat, (client, chat))
                 chat = the_cache
             else:
                 result = get_chat(client, chat)
 
                 if cache and result:
-                    glovar.chats[chat] = result
+                    glovar.chats.put(chat, result)
 
                 chat = result
 
@@ -211,14 +185,7 @@ def get_messages(client: Client, cid: int, mids: Iterable[int]) -> Optional[List
     # Get some messages
     result = None
     try:
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                result = client.get_messages(chat_id=cid, message_ids=mids)
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
+        result = request(cid, False, client.get_messages, chat_id=cid, message_ids=mids)
     except Exception as e:
         logger.warning(f"Get messages {mids} in {cid} error: {e}", exc_info=True)
 
@@ -233,16 +200,9 @@ def get_user_bio(client: Client, uid: int, normal: bool = False, printable: bool
         if not user_id:
             return None
 
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                user: UserFull = client.send(GetFullUser(id=user_id))
-                if user and user.about:
-                    result = t2t(user.about, normal, printable)
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
+        user: UserFull = request(0, False, client.send, GetFullUser(id=user_id))
+        if user and user.about:
+            result = t2t(user.about, normal, printable)
     except Exception as e:
         logger.warning(f"Get user {uid} bio error: {e}", exc_info=True)
 
@@ -253,14 +213,7 @@ def kick_chat_member(client: Client, cid: int, uid: Union[int, str]) -> Union[bo
     # Kick a chat member in a group
     result = None
     try:
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                result = client.kick_chat_member(chat_id=cid, user_id=uid)
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
+        result = request(cid, False, client.kick_chat_member, chat_id=cid, user_id=uid)
     except Exception as e:
         logger.warning(f"Kick chat member {uid} in {cid} error: {e}", exc_info=True)
 
@@ -270,38 +223,37 @@ def kick_chat_member(client: Client, cid: int, uid: Union[int, str]) -> Union[bo
 def leave_chat(client: Client, cid: int, delete: bool = False) -> bool:
     # Leave a channel
     try:
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                client.leave_chat(chat_id=cid, delete=delete)
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
-            except (PeerIdInvalid, ChannelInvalid, ChannelPrivate):
-                return False
+        request(cid, False, client.leave_chat, chat_id=cid, delete=delete)
 
         return True
+    except (PeerIdInvalid, ChannelInvalid, ChannelPrivate):
+        return False
     except Exception as e:
         logger.warning(f"Leave chat {cid} error: {e}", exc_info=True)
 
     return False
 
 
+def refresh_chat(client: Client, cid: int) -> bool:
+    # Fetch a cached chat again
+    try:
+        result = get_chat(client, cid)
+        result and glovar.chats.put(cid, result)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Refresh chat {cid} error: {e}", exc_info=True)
+
+    return False
+
+
 def resolve_peer(client: Client, pid: Union[int, str]) -> Union[bool, InputPeerChannel, InputPeerUser, None]:
     # Get an input peer by id
     result = None
     try:
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                result = client.resolve_peer(pid)
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
-            except (PeerIdInvalid, UsernameInvalid, UsernameNotOccupied):
-                return False
+        result = request(0, False, client.resolve_peer, pid)
+    except (PeerIdInvalid, UsernameInvalid, UsernameNotOccupied):
+        return False
     except Exception as e:
         logger.warning(f"Resolve peer {pid} error: {e}", exc_info=True)
 
@@ -341,14 +293,14 @@ def resolve_username(client: Client, username: str, cache: bool = True) -> (str,
     return peer_type, peer_id
 
 
-@retry
 def send_document(client: Client, cid: int, document: str, caption: str = "", mid: int = None,
                   markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, None]:
     # Send a document to a chat
     result = None
 
     try:
-        result = client.send_document(
+        result = request(
+            cid, True, client.send_document,
             chat_id=cid,
             document=document,
             caption=caption,
@@ -356,9 +308,6 @@ def send_document(client: Client, cid: int, document: str, caption: str = "", mi
             reply_to_message_id=mid,
             reply_markup=markup
         )
-    except FloodWait as e:
-        logger.warning(f"Send document {document} to {cid} - Sleep for {e.x} second(s)")
-        raise e
     except (ButtonDataInvalid, ButtonUrlInvalid):
         logger.warning(f"Send document {document} to {cid} - invalid markup: {markup}")
     except (ChannelInvalid, ChannelPrivate, ChatAdminRequired, PeerIdInvalid):
@@ -369,7 +318,6 @@ def send_document(client: Client, cid: int, document: str, caption: str = "", mi
     return result
 
 
-@retry
 def send_message(client: Client, cid: int, text: str, mid: int = None,
                  markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, None]:
     # Send a message to a chat
@@ -379,7 +327,8 @@ def send_message(client: Client, cid: int, text: str, mid: int = None,
         if not text.strip():
             return None
 
-        result = client.send_message(
+        result = request(
+            cid, True, client.send_message,
             chat_id=cid,
             text=text,
             parse_mode="html",
@@ -387,9 +336,6 @@ def send_message(client: Client, cid: int, text: str, mid: int = None,
             reply_to_message_id=mid,
             reply_markup=markup
         )
-    except FloodWait as e:
-        logger.warning(f"Send message to {cid} - Sleep for {e.x} second(s)")
-        raise e
     except (ButtonDataInvalid, ButtonUrlInvalid, ReplyMarkupInvalid):
         logger.warning(f"Send message to {cid} - invalid markup: {markup}")
     except (ChannelInvalid, ChannelPrivate, ChatAdminRequired, PeerIdInvalid):
@@ -400,45 +346,11 @@ def send_message(client: Client, cid: int, text: str, mid: int = None,
     return result
 
 
-@threaded()
-def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int = None,
-                        markup: InlineKeyboardMarkup = None) -> Optional[bool]:
-    # Send a message that will be auto deleted to a chat
-    result = None
-
-    try:
-        result = send_message(
-            client=client,
-            cid=cid,
-            text=text,
-            mid=mid,
-            markup=markup
-        )
-
-        if not result:
-            return None
-
-        mid = result.message_id
-        mids = [mid]
-        result = delay(secs, delete_messages, [client, cid, mids])
-    except Exception as e:
-        logger.warning(f"Send report message to {cid} error: {e}", exc_info=True)
-
-    return result
-
-
 def unban_chat_member(client: Client, cid: int, uid: Union[int, str]) -> Optional[bool]:
     # Unban a user in a group
     result = None
     try:
-        flood_wait = True
-        while flood_wait:
-            flood_wait = False
-            try:
-                result = client.unban_chat_member(chat_id=cid, user_id=uid)
-            except FloodWait as e:
-                flood_wait = True
-                wait_flood(e)
+        result = request(cid, False, client.unban_chat_member, chat_id=cid, user_id=uid)
     except Exception as e:
         logger.warning(f"Unban chat member {uid} in {cid} error: {e}", exc_info=True)
 
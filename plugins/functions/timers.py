@@ -17,6 +17,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from heapq import heappop
 from time import sleep
 
 from pyrogram import Client
@@ -24,8 +25,10 @@ from pyrogram import Client
 from plugins import glovar
 from plugins.functions.channel import share_data
 from plugins.functions.etc import code, general_link, get_now, lang, thread
-from plugins.functions.file import data_to_file, save
+from plugins.functions.file import data_to_file, save, snapshot_to_file
 from plugins.functions.group import delete_message, leave_group, save_admins
+from plugins.functions.ids import check_admin_groups, clear_user_ids, clear_user_status, remove_report
+from plugins.functions.store import export
 from plugins.functions.telegram import get_admins, get_group_info, send_message
 
 # Enable logging
@@ -40,6 +43,15 @@ def backup_files(client: Client) -> bool:
             if not eval(f"glovar.{file}"):
                 continue
 
+            # The data is exported to a temp file in the compact format
+            if glovar.sqlite and file in glovar.sqlite_list:
+                path = data_to_file(export(eval(f"glovar.{file}")), True)
+            else:
+                path = snapshot_to_file(file)
+
+            if not path:
+                continue
+
             # Share
             share_data(
                 client=client,
@@ -47,7 +59,7 @@ def backup_files(client: Client) -> bool:
                 action="backup",
                 action_type="data",
                 data=file,
-                file=f"data/{file}"
+                file=path
             )
             sleep(5)
 
@@ -65,51 +77,31 @@ def interval_hour_01(client: Client) -> bool:
     glovar.locks["message"].acquire()
 
     try:
-        # Clear old calling messages
+        # Get the expired calling messages and reports, the records changed after being indexed are skipped
         now = get_now()
+        mids = []
 
-        for gid in list(glovar.message_ids):
-            mid, time = glovar.message_ids[gid]
-
-            if not time:
-                continue
+        while glovar.expiry_ids and now - glovar.expiry_ids[0][0] >= 86400:
+            time, the_type, key = heappop(glovar.expiry_ids)
 
-            if now - time < 86400:
-                continue
-
-            glovar.message_ids[gid] = (0, 0)
-            delete_message(client, gid, mid)
-
-        save("message_ids")
-
-        # Clear old reports
-        now = get_now()
-
-        for key in list(glovar.reports):
-            report_record = glovar.reports[key]
-            time = report_record["time"]
-
-            if not time:
-                glovar.reports.pop(key, {})
+            if the_type == "message_ids" and glovar.message_ids.get(key, (0, 0))[1] == time:
+                mids.append((key, glovar.message_ids[key][0]))
+                glovar.message_ids[key] = (0, 0)
+            elif the_type == "reports" and (glovar.reports.get(key) or {}).get("time", -1) == time:
+                report_record = remove_report(key)
+                time and mids.append((report_record["group_id"], report_record["report_id"]))
+            else:
                 continue
 
-            if now - time < 86400:
-                continue
+            save(the_type)
 
-            gid = report_record["group_id"]
-            mid = report_record["report_id"]
+        # Delete the messages
+        for gid, mid in mids:
             thread(delete_message, (client, gid, mid))
-            glovar.reports.pop(key, {})
-
-        save("reports")
-
-        # Clear user's waiting status
-        reported_users = {glovar.reports[key]["user_id"] for key in glovar.reports}
-
-        for uid in set(glovar.user_ids) - reported_users:
-            glovar.user_ids[uid]["waiting"] = set()
 
-        save("user_ids")
+        # Clear user's waiting status, only the indexed waiting users without an open report are checked
+        for uid in glovar.waiting_ids - set(glovar.report_users):
+            clear_user_status(uid, "waiting")
 
         result = True
     except Exception as e:
@@ -131,16 +123,14 @@ def reset_data(client: Client) -> bool:
         glovar.left_group_ids = set()
         save("left_group_ids")
 
-        glovar.user_ids = {}
-        save("user_ids")
+        clear_user_ids()
 
-        glovar.watch_ids = {
-            "ban": {},
-            "delete": {}
-        }
+        glovar.watch_ids["ban"].clear()
+        glovar.watch_ids["delete"].clear()
         save("watch_ids")
 
-        glovar.reports = {}
+        glovar.reports.clear()
+        glovar.report_users.clear()
         save("reports")
 
         # Send debug message
@@ -240,6 +230,9 @@ def update_admins(client: Client) -> bool:
                           f"{lang('status')}{lang('colon')}{code(reason)}\n")
             thread(send_message, (client, glovar.debug_channel_id, debug_text))
 
+        # Check the reverse admin index
+        check_admin_groups()
+
         result = True
     except Exception as e:
         logger.warning(f"Update admin error: {e}", exc_info=True)
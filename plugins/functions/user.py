@@ -26,12 +26,13 @@ from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message,
 
 from plugins import glovar
 from plugins.functions.channel import ask_for_help, forward_evidence, send_debug, update_score
-from plugins.functions.etc import button_data, code, delay, general_link, get_channel_link, get_int, get_now, get_text, lang
+from plugins.functions.etc import button_data, code, general_link, get_channel_link, get_int, get_now, get_text, lang
 from plugins.functions.etc import mention_id, message_link, random_str, thread
 from plugins.functions.file import save
 from plugins.functions.filters import is_class_c, is_from_user, is_limited_admin
 from plugins.functions.group import delete_message
-from plugins.functions.ids import init_user_id
+from plugins.functions.ids import add_expiry, add_report, add_user_status, add_user_warn, discard_user_status
+from plugins.functions.ids import init_user_id, lock_user, unlock_user, update_user_warn
 from plugins.functions.telegram import edit_message_text, kick_chat_member, unban_chat_member
 
 # Enable logging
@@ -51,18 +52,13 @@ def ban_user(client: Client, message: Message, uid: int, aid: int, result: int =
         if is_limited_admin(gid, aid):
             return "", None
 
-        # Init user data
-        if not init_user_id(uid):
-            return "", None
-
-        # Check users' locks
-        if gid in glovar.user_ids[uid]["lock"]:
+        # Init user data and lock the user
+        if not lock_user(uid, gid):
             return "", None
 
         # Proceed
-        glovar.user_ids[uid]["lock"].add(gid)
         try:
-            if gid in glovar.user_ids[uid]["ban"]:
+            if gid in glovar.user_ids[uid].ban:
                 text += (f"{lang('user_id')}{lang('colon')}{mention_id(uid)}\n"
                          f"{lang('action')}{lang('colon')}{code(lang('action_ban'))}\n"
                          f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
@@ -90,8 +86,8 @@ def ban_user(client: Client, message: Message, uid: int, aid: int, result: int =
 
             # Ban the user
             thread(kick_chat_member, (client, gid, uid))
-            glovar.user_ids[uid]["ban"].add(gid)
-            glovar.user_ids[uid]["warn"].pop(gid, 0)
+            add_user_status(uid, "ban", gid)
+            update_user_warn(uid, gid, 0)
             update_score(client, uid)
 
             # Generate report text
@@ -128,7 +124,7 @@ def ban_user(client: Client, message: Message, uid: int, aid: int, result: int =
                 reason=reason
             )
         finally:
-            glovar.user_ids[uid]["lock"].discard(gid)
+            unlock_user(uid, gid)
     except Exception as e:
         logger.warning(f"Ban user error: {e}", exc_info=True)
 
@@ -144,33 +140,28 @@ def forgive_user(client: Client, message: Message, uid: int, reason: str = None)
         gid = message.chat.id
         aid = message.from_user.id
 
-        # Init user data
-        if not init_user_id(uid):
-            return "", False
-
-        # Check users' locks
-        if gid in glovar.user_ids[uid]["lock"]:
+        # Init user data and lock the user
+        if not lock_user(uid, gid):
             return "", False
 
         # Proceed
-        glovar.user_ids[uid]["lock"].add(gid)
         try:
             # Text prefix
             text += f"{lang('user_id')}{lang('colon')}{mention_id(uid)}\n"
 
-            if gid in glovar.user_ids[uid]["ban"]:
-                glovar.user_ids[uid]["ban"].discard(gid)
+            if gid in glovar.user_ids[uid].ban:
+                discard_user_status(uid, "ban", gid)
                 thread(unban_chat_member, (client, gid, uid))
                 text += (f"{lang('action')}{lang('colon')}{code(lang('action_unban'))}\n"
                          f"{lang('status')}{lang('colon')}{code(lang('status_succeeded'))}\n")
                 success = True
-            elif glovar.user_ids[uid]["warn"].get(gid, 0):
-                glovar.user_ids[uid]["warn"].pop(gid, 0)
+            elif glovar.user_ids[uid].warn.get(gid, 0):
+                update_user_warn(uid, gid, 0)
                 text += (f"{lang('action')}{lang('colon')}{code(lang('action_unwarns'))}\n"
                          f"{lang('status')}{lang('colon')}{code(lang('status_succeeded'))}\n")
                 success = True
-            elif gid in glovar.user_ids[uid]["waiting"]:
-                glovar.user_ids[uid]["waiting"].discard(gid)
+            elif gid in glovar.user_ids[uid].waiting:
+                discard_user_status(uid, "waiting", gid)
                 text += (f"{lang('action')}{lang('colon')}{code(lang('action_unwait'))}\n"
                          f"{lang('status')}{lang('colon')}{code(lang('status_succeeded'))}\n")
                 success = True
@@ -185,8 +176,6 @@ def forgive_user(client: Client, message: Message, uid: int, reason: str = None)
             if not success:
                 return text, success
 
-            save("user_ids")
-
             if reason:
                 text += f"{lang('reason')}{lang('colon')}{code(reason)}\n"
 
@@ -200,7 +189,7 @@ def forgive_user(client: Client, message: Message, uid: int, reason: str = None)
                 reason=reason
             )
         finally:
-            glovar.user_ids[uid]["lock"].discard(gid)
+            unlock_user(uid, gid)
     except Exception as e:
         logger.warning(f"Forgive user error: {e}")
 
@@ -299,7 +288,7 @@ def mention_answer(client: Client, message: Message, aid: int, uid: int, action_
 
             # Edit the report message
             thread(edit_message_text, (client, gid, mid, text, markup))
-            delay(180, delete_message, [client, gid, mid])
+            delete_message(client, gid, mid, 180)
 
         # Delete
         elif action_type == "delete":
@@ -325,19 +314,14 @@ def remove_user(client: Client, message: Message, uid: int, aid: int,
         if is_limited_admin(gid, aid):
             return "", False
 
-        # Init user data
-        if not init_user_id(uid):
-            return "", False
-
-        # Check users' locks
-        if gid in glovar.user_ids[uid]["lock"]:
+        # Init user data and lock the user
+        if not lock_user(uid, gid):
             return "", False
 
         # Proceed
-        glovar.user_ids[uid]["lock"].add(gid)
         try:
             # Check ban status
-            if gid in glovar.user_ids[uid]["ban"]:
+            if gid in glovar.user_ids[uid].ban:
                 text += (f"{lang('user_id')}{lang('colon')}{mention_id(uid)}\n"
                          f"{lang('action')}{lang('colon')}{code(lang('action_kick'))}\n"
                          f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
@@ -366,7 +350,7 @@ def remove_user(client: Client, message: Message, uid: int, aid: int,
 
             # Kick the user
             kick_user(client, gid, uid)
-            glovar.user_ids[uid]["kick"].add(gid)
+            add_user_status(uid, "kick", gid)
             update_score(client, uid)
 
             # Generate report text
@@ -393,7 +377,7 @@ def remove_user(client: Client, message: Message, uid: int, aid: int,
                 reason=reason
             )
         finally:
-            glovar.user_ids[uid]["lock"].discard(gid)
+            unlock_user(uid, gid)
     except Exception as e:
         logger.warning(f"Remove user error: {e}", exc_info=True)
 
@@ -413,9 +397,8 @@ def report_answer(client: Client, message: Message, gid: int, aid: int, mid: int
                     f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
                     f"{lang('reason')}{lang('colon')}{code(lang('expired'))}\n")
             thread(edit_message_text, (client, gid, mid, text))
-            delay(15, delete_message, [client, gid, mid])
-            glovar.user_ids[uid]["waiting"].discard(gid)
-            save("user_ids")
+            delete_message(client, gid, mid, 15)
+            discard_user_status(uid, "waiting", gid)
             return ""
 
         if not report_record["time"]:
@@ -433,11 +416,12 @@ def report_answer(client: Client, message: Message, gid: int, aid: int, mid: int
             return ""
 
         # Check users' locks
-        if gid in glovar.user_ids[uid]["lock"] or gid in glovar.user_ids[rid]["lock"]:
+        if gid in glovar.user_ids[uid].lock or gid in glovar.user_ids[rid].lock:
             return lang("answer_proceeded")
 
         # Lock the report status
         glovar.reports[key]["time"] = 0
+        add_expiry("reports", key, 0)
         try:
             if action_type == "ban":
                 text, markup = ban_user(client, message, uid, aid, 0, reason)
@@ -475,13 +459,12 @@ def report_answer(client: Client, message: Message, gid: int, aid: int, mid: int
                 secs = 15
 
             thread(edit_message_text, (client, gid, mid, text, markup))
-            delay(secs, delete_message, [client, gid, mid])
+            delete_message(client, gid, mid, secs)
         finally:
-            glovar.user_ids[uid]["lock"].discard(gid)
-            glovar.user_ids[rid]["lock"].discard(gid)
-            glovar.user_ids[uid]["waiting"].discard(gid)
-            glovar.user_ids[rid]["waiting"].discard(gid)
-            save("user_ids")
+            unlock_user(uid, gid)
+            unlock_user(rid, gid)
+            discard_user_status(uid, "waiting", gid)
+            discard_user_status(rid, "waiting", gid)
     except Exception as e:
         logger.warning(f"Report answer error: {e}", exc_info=True)
 
@@ -501,24 +484,24 @@ def report_user(gid: int, user: User, rid: int, mid: int,
         else:
             return "", None
 
-        glovar.user_ids[uid]["waiting"].add(gid)
-        glovar.user_ids[rid]["waiting"].add(gid)
-        save("user_ids")
+        add_user_status(uid, "waiting", gid)
+        add_user_status(rid, "waiting", gid)
 
         key = random_str(8)
 
         while glovar.reports.get(key):
             key = random_str(8)
 
-        glovar.reports[key] = {
-            "time": get_now(),
+        now = get_now()
+        add_report(key, {
+            "time": now,
             "group_id": gid,
             "reporter_id": rid,
             "user_id": uid,
             "message_id": mid,
             "report_id": 0,
             "reason": reason
-        }
+        })
 
         if rid:
             reporter_text = code("██████")
@@ -585,19 +568,14 @@ def warn_user(client: Client, message: Message, uid: int, aid: int,
         # Basic data
         gid = message.chat.id
 
-        # Init user data
-        if not init_user_id(uid):
-            return "", None
-
-        # Check users' locks
-        if gid in glovar.user_ids[uid]["lock"]:
+        # Init user data and lock the user
+        if not lock_user(uid, gid):
             return "", None
 
         # Proceed
-        glovar.user_ids[uid]["lock"].add(gid)
         try:
             # Check ban status
-            if gid in glovar.user_ids[uid]["ban"]:
+            if gid in glovar.user_ids[uid].ban:
                 text += (f"{lang('user_id')}{lang('colon')}{mention_id(uid)}\n"
                          f"{lang('action')}{lang('colon')}{code(lang('action_warn'))}\n"
                          f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
@@ -622,19 +600,15 @@ def warn_user(client: Client, message: Message, uid: int, aid: int,
                 return text, None
 
             # Add warn count
-            if not glovar.user_ids[uid]["warn"].get(gid, 0):
-                glovar.user_ids[uid]["warn"][gid] = 1
-                update_score(client, uid)
-            else:
-                glovar.user_ids[uid]["warn"][gid] += 1
+            warn_count = add_user_warn(uid, gid)
+            warn_count == 1 and update_score(client, uid)
 
-            # Read count and group config
-            warn_count = glovar.user_ids[uid]["warn"][gid]
+            # Read group config
             limit = glovar.configs[gid]["limit"]
 
             # Warn or ban
             if warn_count >= limit:
-                glovar.user_ids[uid]["lock"].discard(gid)
+                unlock_user(uid, gid)
                 text = (f"{lang('user_banned')}{lang('colon')}{mention_id(uid)}\n"
                         f"{lang('ban_reason')}{lang('colon')}{code(lang('reason_limit'))}\n")
                 _, markup = ban_user(client, message, uid, aid, result, reason)
@@ -671,7 +645,7 @@ def warn_user(client: Client, message: Message, uid: int, aid: int,
             if markup and reason:
                 text += f"{lang('reason')}{lang('colon')}{code(reason)}\n"
         finally:
-            glovar.user_ids[uid]["lock"].discard(gid)
+            unlock_user(uid, gid)
     except Exception as e:
         logger.warning(f"Warn user error: {e}", exc_info=True)
 
@@ -686,7 +660,7 @@ def unban_user(client: Client, message: Message, uid: int, aid: int) -> str:
         gid = message.chat.id
 
         # Check ban status
-        if gid not in glovar.user_ids[uid]["ban"]:
+        if gid not in glovar.user_ids[uid].ban:
             text = (f"{lang('user_id')}{lang('colon')}{mention_id(uid)}\n"
                     f"{lang('action')}{lang('colon')}{code(lang('action_unban'))}\n"
                     f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
@@ -696,7 +670,7 @@ def unban_user(client: Client, message: Message, uid: int, aid: int) -> str:
 
         # Proceed
         unban_chat_member(client, gid, uid)
-        glovar.user_ids[uid]["ban"].discard(gid)
+        discard_user_status(uid, "ban", gid)
         update_score(client, uid)
         text = (f"{lang('user_unbanned')}{lang('colon')}{code(uid)}\n"
                 f"{lang('description')}{lang('colon')}{code(lang('description_by_admin'))}\n")
@@ -719,16 +693,11 @@ def undo_user(client: Client, message: Message, aid: int, uid: int, action_type:
         gid = message.chat.id
         mid = message.message_id
 
-        # Init user data
-        if not init_user_id(uid):
-            return ""
-
-        # Check the user's lock
-        if gid in glovar.user_ids[uid]["lock"]:
+        # Init user data and lock the user
+        if not lock_user(uid, gid):
             return lang("answer_proceeded")
 
         # Proceed
-        glovar.user_ids[uid]["lock"].add(gid)
         try:
             if action_type == "ban":
                 text = unban_user(client, message, uid, aid)
@@ -737,10 +706,7 @@ def undo_user(client: Client, message: Message, aid: int, uid: int, action_type:
 
             thread(edit_message_text, (client, gid, mid, text))
         finally:
-            glovar.user_ids[uid]["lock"].discard(gid)
-
-        # Save data
-        save("user_ids")
+            unlock_user(uid, gid)
     except Exception as e:
         logger.warning(f"Undo user error: {e}", exc_info=True)
 
@@ -755,7 +721,7 @@ def unwarn_user(client: Client, message: Message, uid: int, aid: int) -> str:
         gid = message.chat.id
 
         # Check ban status
-        if gid in glovar.user_ids[uid]["ban"]:
+        if gid in glovar.user_ids[uid].ban:
             text = (f"{lang('user_id')}{lang('colon')}{mention_id(uid)}\n"
                     f"{lang('action')}{lang('colon')}{code(lang('action_unwarn'))}\n"
                     f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
@@ -764,7 +730,7 @@ def unwarn_user(client: Client, message: Message, uid: int, aid: int) -> str:
             return text
 
         # Check warnings count
-        if not glovar.user_ids[uid]["warn"].get(gid, 0):
+        if not glovar.user_ids[uid].warn.get(gid, 0):
             text = (f"{lang('user_id')}{lang('colon')}{mention_id(uid)}\n"
                     f"{lang('action')}{lang('colon')}{lang('action_unwarn')}\n"
                     f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
@@ -773,11 +739,9 @@ def unwarn_user(client: Client, message: Message, uid: int, aid: int) -> str:
             return text
 
         # Proceed
-        glovar.user_ids[uid]["warn"][gid] -= 1
-        warn_count = glovar.user_ids[uid]["warn"][gid]
+        warn_count = add_user_warn(uid, gid, -1)
 
         if warn_count == 0:
-            glovar.user_ids[uid]["warn"].pop(gid, 0)
             update_score(client, uid)
             text = (f"{lang('user_unwarned')}{lang('colon')}{mention_id(uid)}\n"
                     f"{lang('user_warns')}{lang('colon')}{code(lang('reason_none'))}\n")
@@ -0,0 +1,86 @@
+# SCP-079-WARN - Warn or ban someone by admin commands
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WARN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from base64 import b85decode, b85encode
+from json import dumps, loads
+from typing import Any, List, Optional, Tuple
+from zlib import compress, decompress
+
+from plugins.functions.codec import decode, encode
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# The first line of a compact text is "#079 <format> <sender> <receiver>,<receiver>...", the payload follows it
+wire_magic = "#079"
+wire_formats = {"binary": "b", "json": "j"}
+
+
+def get_wire_data(text: str, receiver: str = "") -> Tuple[dict, bool]:
+    # Get the data of a compact text, the payload is not decoded if the text is not addressed to the receiver
+    header = get_wire_header(text)
+
+    if not header:
+        return {}, False
+
+    the_format, sender, receivers = header
+
+    if receiver and receiver not in receivers:
+        return {}, True
+
+    payload = text.partition("\n")[2]
+
+    if the_format == "b":
+        action, action_type, data = decode(decompress(b85decode(payload)))
+    else:
+        action, action_type, data = loads(payload)
+
+    data = {
+        "from": sender,
+        "to": receivers,
+        "action": action,
+        "type": action_type,
+        "data": data
+    }
+
+    return data, True
+
+
+def get_wire_header(text: str) -> Optional[Tuple[str, str, List[str]]]:
+    # Get the format, the sender and the receivers from the header of a compact text
+    if not text.startswith(wire_magic):
+        return None
+
+    parts = text.partition("\n")[0].split(" ")
+
+    if len(parts) != 4 or parts[1] not in wire_formats.values():
+        raise ValueError("invalid header")
+
+    return parts[1], parts[2], parts[3].split(",")
+
+
+def get_wire_text(sender: str, receivers: List[str], action: str, action_type: str, data: Any,
+                  the_format: str) -> str:
+    # Get the compact text of the data, the payload holds the same values as the JSON of the data
+    payload = dumps([action, action_type, data], ensure_ascii=False, separators=(",", ":"))
+
+    if the_format == "binary":
+        payload = b85encode(compress(encode(loads(payload)), 9)).decode("ascii")
+
+    return f"{wire_magic} {wire_formats[the_format]} {sender} {','.join(receivers)}\n{payload}"
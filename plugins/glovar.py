@@ -17,15 +17,21 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from configparser import RawConfigParser
-from os import mkdir
+from heapq import heappush
+from os import cpu_count, mkdir, remove
 from os.path import exists
 from shutil import rmtree
-from threading import Lock
-from typing import Dict, List, Set, Tuple, Union
+from threading import Condition, Event, Lock, RLock
+from typing import Callable, Deque, Dict, FrozenSet, List, Optional, Set, Tuple, Union
 
-from pyrogram.types import Chat
+from plugins.functions.cache import TTLCache
+from plugins.functions.snapshot import get_shard, get_slots, load_shards, load_snapshot, read_record, split_shards
+from plugins.functions.snapshot import write_snapshot
+from plugins.functions.status import UserStatus, get_user_status
+from plugins.functions.store import SQLiteDict, Store, UserDict
 
 # Enable logging
 logging.basicConfig(
@@ -73,6 +79,11 @@ default_group_link: str = ""
 limit_ban: int = 0
 project_link: str = ""
 project_name: str = ""
+save_latency: float = 0.5
+score_batch: Union[bool, str] = "False"
+sqlite: Union[bool, str] = "False"
+wire_format: str = "pretty"
+wire_peers: Union[str, FrozenSet[str]] = ""
 zh_cn: Union[bool, str] = ""
 
 # [encrypt]
@@ -121,6 +132,14 @@ try:
     limit_ban = int(config["custom"].get("limit_ban", str(limit_ban)))
     project_link = config["custom"].get("project_link", project_link)
     project_name = config["custom"].get("project_name", project_name)
+    save_latency = float(config["custom"].get("save_latency", str(save_latency)))
+    score_batch = config["custom"].get("score_batch", score_batch)
+    score_batch = eval(score_batch)
+    sqlite = config["custom"].get("sqlite", sqlite)
+    sqlite = eval(sqlite)
+    wire_format = config["custom"].get("wire_format", wire_format)
+    wire_peers = config["custom"].get("wire_peers", wire_peers)
+    wire_peers = frozenset(peer.strip() for peer in wire_peers.split(",") if peer.strip())
     zh_cn = config["custom"].get("zh_cn", zh_cn)
     zh_cn = eval(zh_cn)
     # [encrypt]
@@ -157,6 +176,10 @@ if (bot_token in {"", "[DATA EXPUNGED]"}
         or limit_ban == 0
         or project_link in {"", "[DATA EXPUNGED]"}
         or project_name in {"", "[DATA EXPUNGED]"}
+        or save_latency < 0
+        or score_batch not in {False, True}
+        or sqlite not in {False, True}
+        or wire_format not in {"binary", "json", "pretty"}
         or zh_cn not in {False, True}
         or key in {b"", b"[DATA EXPUNGED]", "", "[DATA EXPUNGED]"}
         or password in {"", "[DATA EXPUNGED]"}):
@@ -339,10 +362,10 @@ all_commands: List[str] = [
 bot_ids: Set[int] = {captcha_id, clean_id, lang_id, long_id, noflood_id,
                      noporn_id, nospam_id, recheck_id, tip_id, user_id, warn_id}
 
-chats: Dict[int, Chat] = {}
-# chats = {
-#     -10012345678: Chat
-# }
+# A TTLCache of at most 4096 chats, an entry expires 3600 secs after it is put, the least recently used go first
+# The hot entries are refreshed in the background after 80% of the TTL
+chats: TTLCache = TTLCache(4096, 3600)
+# chats.get(-10012345678) = Chat
 
 counts: Dict[int, Dict[int, int]] = {}
 # counts = {
@@ -356,6 +379,15 @@ declared_message_ids: Dict[int, Set[int]] = {}
 #     -10012345678: {123}
 # }
 
+delete_buffer: Dict[int, List[int]] = {}
+# delete_buffer = {
+#     -10012345678: [123, 124]
+# }
+
+delete_limit: int = 100
+
+delete_window: float = 0.2
+
 default_config: Dict[str, Union[bool, int, Dict[str, bool]]] = {
     "default": True,
     "lock": 0,
@@ -368,29 +400,115 @@ default_config: Dict[str, Union[bool, int, Dict[str, bool]]] = {
     }
 }
 
-default_user_status: Dict[str, Union[float, Dict[Union[int, str], Union[float, int]], Set[int]]] = {
-    "ban": set(),
-    "kick": set(),
-    "lock": set(),
-    "score": {
-        "captcha": 0.0,
-        "clean": 0.0,
-        "lang": 0.0,
-        "long": 0.0,
-        "noflood": 0.0,
-        "noporn": 0.0,
-        "nospam": 0.0,
-        "recheck": 0.0,
-        "warn": 0.0
-    },
-    "warn": {},
-    "waiting": set()
-}
+expiry_ids: List[Tuple[int, str, Union[int, str]]] = []
+# expiry_ids = [
+#     (1512345678, "message_ids", -10012345678),
+#     (1512345678, "reports", "random")
+# ]
+
+journal_limit: int = 16 * 1024 * 1024
+
+journal_ops: List[Tuple] = []
+# journal_ops = [
+#     ("add", 12345678, "ban", -10012345678),
+#     ("score", 12345678, "captcha", 1.0)
+# ]
+
+journal_size: int = 0
+
+# The user and group locks are striped, an id uses the lock at id % lock_stripes
+lock_stripes: int = 64
+
+group_locks: List[RLock] = [RLock() for _ in range(lock_stripes)]
+
+user_locks: List[RLock] = [RLock() for _ in range(lock_stripes)]
 
 locks: Dict[str, Lock] = {
     "admin": Lock(),
+    "delete": Lock(),
+    "file": Lock(),
     "message": Lock(),
-    "receive": Lock()
+    "receive": Lock(),
+    "route": Lock(),
+    "save": Lock(),
+    "score": Lock(),
+    "thread": Lock()
+}
+
+outbound_buckets: Dict[int, Tuple[float, float]] = {}
+# outbound_buckets = {
+#     0: (29.5, 12345.678),
+#     -10012345678: (19.0, 12345.678)
+# }
+
+outbound_busy: List[int] = [0, 0, 0, 0]
+
+outbound_condition: Condition = Condition()
+
+outbound_count: int = 0
+
+# The priorities of the outbound requests, lower ones are sent first
+outbound_moderation: int = 0
+outbound_evidence: int = 1
+outbound_exchange: int = 2
+outbound_debug: int = 3
+
+outbound_limit: int = 4096
+
+# The pauses of the chats, the chat-less methods, and 0 for every sending request
+outbound_pauses: Dict[Union[int, str], float] = {}
+# outbound_pauses = {
+#     -10012345678: 12345.678,
+#     "resolve_peer": 12345.678
+# }
+
+outbound_queues: List[List[Tuple[float, int, tuple]]] = [[], [], [], []]
+
+# Telegram's limits of sending messages, (tokens per sec, capacity)
+outbound_rates: Dict[str, Tuple[float, int]] = {
+    "global": (30.0, 30),
+    "group": (20 / 60, 20),
+    "private": (1.0, 1)
+}
+
+outbound_reserve: int = 10
+
+outbound_shed: int = 200
+
+outbound_started: int = 0
+
+outbound_workers: int = 8
+
+# The routes that touch one user or one group, or take all the user locks, run without the receive lock
+parallel_routes: Set[Tuple[str, Optional[str]]] = {
+    ("add", "bad"),
+    ("add", "watch"),
+    ("help", "report"),
+    ("remove", "score"),
+    ("update", "declare"),
+    ("update", "score"),
+    ("update", "scores")
+}
+
+# The senders allowed to send each (action, type) to this bot, the type None matches all the types
+permissions: Dict[Tuple[str, Optional[str]], Set[str]] = {
+    ("add", "bad"): {"CLEAN", "LANG", "LONG", "MANAGE", "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK"},
+    ("add", "watch"): {"CLEAN", "LANG", "LONG", "NOFLOOD", "NOPORN", "RECHECK", "WATCH"},
+    ("backup", "now"): {"MANAGE"},
+    ("backup", "rollback"): {"MANAGE"},
+    ("clear", None): {"MANAGE"},
+    ("config", "commit"): {"CONFIG"},
+    ("config", "reply"): {"CONFIG"},
+    ("config", "show"): {"MANAGE"},
+    ("help", "report"): {"NOSPAM"},
+    ("leave", "approve"): {"MANAGE"},
+    ("remove", "bad"): {"MANAGE"},
+    ("remove", "score"): {"MANAGE"},
+    ("remove", "watch"): {"MANAGE"},
+    ("update", "declare"): {"CAPTCHA", "CLEAN", "LANG", "LONG", "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK"},
+    ("update", "refresh"): {"MANAGE"},
+    ("update", "score"): {"CAPTCHA", "CLEAN", "LANG", "LONG", "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK"},
+    ("update", "scores"): {"CAPTCHA", "CLEAN", "LANG", "LONG", "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK"}
 }
 
 receivers: Dict[str, List[str]] = {
@@ -398,10 +516,89 @@ receivers: Dict[str, List[str]] = {
               "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK", "TIP", "USER", "WARN", "WATCH"],
 }
 
+# The upper bounds in secs of the latency histogram buckets, the last bucket has no bound
+route_buckets: Tuple[float, ...] = (0.001, 0.005, 0.025, 0.1, 0.5)
+
+route_rejected: int = 0
+
+route_stats: Dict[Tuple[str, str, str], List[int]] = {}
+# route_stats = {
+#     ("CLEAN", "update", "score"): [15, 12, 3, 0, 0, 0, 0]
+# }
+
+save_event: Event = Event()
+
+saves: Set[str] = set()
+# saves = {"user_ids"}
+
+# The score changes waiting to be shared, the last score of a user wins
+score_ids: Dict[int, float] = {}
+# score_ids = {
+#     12345678: 1.4
+# }
+
+# The batches larger than score_limit are shared as a file
+score_limit: int = 50
+
+score_window: float = 1.0
+
 sender: str = "WARN"
 
 should_hide: bool = False
 
+# The I/O pool runs the API calls, the CPU pool runs the serialization
+thread_dropped: Dict[str, int] = {
+    "cpu": 0,
+    "io": 0
+}
+
+thread_limits: Dict[str, int] = {
+    "cpu": 256,
+    "io": 1024
+}
+
+# The calls beyond the limit wait here until a pool call finishes, the calls beyond the overflow limit are dropped
+thread_overflow: Dict[str, Deque[Tuple[Callable, tuple, dict]]] = {
+    "cpu": deque(),
+    "io": deque()
+}
+
+thread_overflow_limit: int = 8192
+
+thread_pending: Dict[str, int] = {
+    "cpu": 0,
+    "io": 0
+}
+
+thread_pools: Dict[str, ThreadPoolExecutor] = {
+    "cpu": ThreadPoolExecutor(max_workers=cpu_count() or 4, thread_name_prefix="cpu"),
+    "io": ThreadPoolExecutor(max_workers=32, thread_name_prefix="io")
+}
+
+thread_saturated: Dict[str, int] = {
+    "cpu": 0,
+    "io": 0
+}
+
+timer_condition: Condition = Condition()
+
+timer_count: int = 0
+
+timer_ids: Set[int] = set()
+
+timer_started: bool = False
+
+timers: List[Tuple[float, int, Callable, list]] = []
+# timers = [
+#     (12345.678, 1, delete_messages, [client, -10012345678, [123]])
+# ]
+
+sqlite_cache: int = 65536
+
+user_dirty: Set[int] = set()
+
+user_shards: int = 256
+
 usernames: Dict[str, Dict[str, Union[int, str]]] = {}
 # usernames = {
 #     "SCP_079": {
@@ -412,7 +609,9 @@ usernames: Dict[str, Dict[str, Union[int, str]]] = {}
 
 version: str = "0.3.9"
 
-# Load data from pickle
+waiting_ids: Set[int] = set()
+
+# Load data from snapshots
 
 # Init dir
 try:
@@ -420,12 +619,17 @@ try:
 except Exception as e:
     logger.info(f"Remove tmp error: {e}")
 
-for path in ["data", "tmp"]:
+for path in ["data", "data/users", "tmp"]:
     if not exists(path):
         mkdir(path)
 
 # Init ids variables
 
+admin_groups: Dict[int, Set[int]] = {}
+# admin_groups = {
+#     12345678: {-10012345678}
+# }
+
 admin_ids: Dict[int, Set[int]] = {}
 # admin_ids = {
 #     -10012345678: {12345678}
@@ -454,28 +658,18 @@ trust_ids: Dict[int, Set[int]] = {}
 #     -10012345678: {12345678}
 # }
 
-user_ids: Dict[int, Dict[str, Union[float, Dict[Union[int, str], Union[float, int]], Set[int]]]] = {}
+user_ids: Dict[int, UserStatus] = {}
 # user_ids = {
-#     12345678: {
-#         "ban": {-10012345675},
-#         "kick": {-10012345676},
-#         "lock": {-10012345677},
-#         "score": {
-#             "captcha": 0.0,
-#             "clean": 0.0,
-#             "lang": 0.0,
-#             "long": 0.0,
-#             "noflood": 0.0,
-#             "noporn": 0.0,
-#             "nospam": 0.0,
-#             "recheck": 0.0,
-#             "warn": 1.7
-#         }
-#         "warn": {
-#             -10012345678: 0
+#     12345678: UserStatus(
+#         ban={-10012345675},
+#         kick={-10012345676},
+#         lock={-10012345677},
+#         score=array("f", [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.7, 1.7]),
+#         warn={
+#             -10012345678: 1
 #         },
-#         "waiting": {-10012345679}
-#     }
+#         waiting={-10012345679}
+#     )
 # }
 
 watch_ids: Dict[str, Dict[int, int]] = {
@@ -493,6 +687,13 @@ watch_ids: Dict[str, Dict[int, int]] = {
 
 # Init data variables
 
+delete_ids: Dict[int, Dict[int, int]] = {}
+# delete_ids = {
+#     -10012345678: {
+#         123: 1512345678
+#     }
+# }
+
 configs: Dict[int, Dict[str, Union[bool, int, Dict[str, bool]]]] = {}
 # configs = {
 #     -10012345678: {
@@ -507,6 +708,12 @@ configs: Dict[int, Dict[str, Union[bool, int, Dict[str, bool]]]] = {}
 #     }
 # }
 
+# The number of open reports of each reported user
+report_users: Dict[int, int] = {}
+# report_users = {
+#     12345679: 1
+# }
+
 reports: Dict[str, Dict[str, Union[int, str]]] = {}
 # reports = {
 #     "random": {
@@ -523,24 +730,165 @@ reports: Dict[str, Dict[str, Union[int, str]]] = {}
 # Load data
 file_list: List[str] = ["admin_ids", "bad_ids", "lack_group_ids", "left_group_ids", "message_ids",
                         "trust_ids", "user_ids", "watch_ids",
-                        "configs", "reports"]
+                        "configs", "delete_ids", "reports"]
+sqlite_list: List[str] = ["admin_ids", "configs", "message_ids", "reports", "user_ids", "watch_ids"]
+
+generations: Dict[str, int] = {}
+
+store: Optional[Store] = None
+sqlite_ready: bool = False
+
+if sqlite:
+    store = Store("data/data.db")
+    sqlite_ready = bool(store.execute("PRAGMA user_version")[0][0])
+
 for file in file_list:
+    # The data is already in SQLite
+    if sqlite_ready and file in sqlite_list:
+        continue
+
+    # The user data is split into shards
+    if file == "user_ids":
+        continue
+
     try:
-        try:
-            if exists(f"data/{file}") or exists(f"data/.{file}"):
-                with open(f"data/{file}", "rb") as f:
-                    locals()[f"{file}"] = pickle.load(f)
-            else:
-                with open(f"data/{file}", "wb") as f:
-                    pickle.dump(eval(f"{file}"), f)
-        except Exception as e:
-            logger.error(f"Load data {file} error: {e}", exc_info=True)
-            with open(f"data/.{file}", "rb") as f:
-                locals()[f"{file}"] = pickle.load(f)
+        generation, data = load_snapshot(file)
+
+        if generation < 0:
+            generation = 1
+            write_snapshot(file, generation, eval(f"{file}"))
+        else:
+            locals()[f"{file}"] = data
+
+        generations[file] = generation
     except Exception as e:
-        logger.critical(f"Load data {file} backup error: {e}", exc_info=True)
+        logger.critical(f"Load data {file} error: {e}", exc_info=True)
         raise SystemExit("[DATA CORRUPTION]")
 
+# Load the user data shards, a remaining single file means the migration to shards is unfinished
+try:
+    if not sqlite_ready:
+        shard_generations, user_ids = load_shards("users", user_shards)
+        generations.update(shard_generations)
+        generation, data = load_snapshot("user_ids")
+
+        # Records of older versions are dicts, a remaining single file is split into the shards
+        if generation >= 0:
+            user_ids = {uid: get_user_status(data[uid]) for uid in data}
+
+            for index, shard in enumerate(split_shards(user_ids, user_shards)):
+                generation = generations.get(get_shard("users", index), 0) + 1
+                write_snapshot(get_shard("users", index), generation, shard)
+                generations[get_shard("users", index)] = generation
+
+            for path in get_slots("user_ids"):
+                exists(path) and remove(path)
+        else:
+            user_ids = {uid: get_user_status(user_ids[uid]) for uid in user_ids}
+except Exception as e:
+    logger.critical(f"Load user data shards error: {e}", exc_info=True)
+    raise SystemExit("[DATA CORRUPTION]")
+
+# Replay the user data journal, the replayed shards stay dirty until the next snapshot
+try:
+    if not sqlite_ready and exists("data/user_ids.journal"):
+        with open("data/user_ids.journal", "r+b") as f:
+            while True:
+                try:
+                    journal_size = f.tell()
+                    ops = read_record(f)
+                except EOFError:
+                    break
+                except Exception as e:
+                    logger.error(f"Load journal record error: {e}", exc_info=True)
+                    break
+
+                for op, uid, *args in ops:
+                    if op == "drop":
+                        user_ids = {}
+                        user_dirty.update(range(user_shards))
+                        continue
+
+                    user_dirty.add(uid % user_shards)
+
+                    if op == "put":
+                        user_ids[uid] = get_user_status(args[0])
+                        continue
+
+                    if op == "reset" or uid not in user_ids:
+                        user_ids[uid] = UserStatus()
+
+                    if op == "add":
+                        user_ids[uid].add(args[0], args[1])
+                    elif op == "clear":
+                        user_ids[uid].clear(args[0])
+                    elif op == "discard":
+                        user_ids[uid].discard(args[0], args[1])
+                    elif op == "score":
+                        user_ids[uid].set_score(args[0], args[1])
+                    elif op == "warn":
+                        user_ids[uid].set_warn(args[0], args[1])
+
+            # Drop the incomplete record written by an interrupted append
+            f.truncate(journal_size)
+except Exception as e:
+    logger.critical(f"Replay journal error: {e}", exc_info=True)
+    raise SystemExit("[DATA CORRUPTION]")
+
+# Use the SQLite tables
+if sqlite:
+    try:
+        tables = {
+            "admin_ids": SQLiteDict(store, "admin_ids"),
+            "configs": SQLiteDict(store, "configs"),
+            "message_ids": SQLiteDict(store, "message_ids"),
+            "reports": SQLiteDict(store, "reports"),
+            "user_ids": UserDict(store, sqlite_cache, user_locks),
+            "watch_ids": {
+                "ban": SQLiteDict(store, "watch_ids", "ban"),
+                "delete": SQLiteDict(store, "watch_ids", "delete")
+            }
+        }
+
+        # Import the data from the snapshots for the first time
+        if not sqlite_ready:
+            for file in ["admin_ids", "configs", "message_ids", "reports"]:
+                tables[file].update(locals()[file])
+                tables[file].commit()
+
+            for the_type in ["ban", "delete"]:
+                tables["watch_ids"][the_type].update(watch_ids.get(the_type, {}))
+                tables["watch_ids"][the_type].commit()
+
+            tables["user_ids"].apply([("put", uid, user_ids[uid]) for uid in user_ids], set())
+            store.execute("PRAGMA user_version = 1")
+
+        for file in sqlite_list:
+            locals()[file] = tables[file]
+    except Exception as e:
+        logger.critical(f"Load SQLite data error: {e}", exc_info=True)
+        raise SystemExit("[DATA CORRUPTION]")
+
+# Build the expiry index and the reported users index, this is the only full read of the two tables in SQLite mode,
+# message_ids holds one entry per group and the reports expire within a day
+for gid in message_ids:
+    message_ids[gid][1] and heappush(expiry_ids, (message_ids[gid][1], "message_ids", gid))
+
+for key in reports:
+    heappush(expiry_ids, (reports[key]["time"], "reports", key))
+    report_users[reports[key]["user_id"]] = report_users.get(reports[key]["user_id"], 0) + 1
+
+# Build the waiting index
+if sqlite:
+    waiting_ids = user_ids.get_uids("waiting")
+else:
+    waiting_ids = {uid for uid in user_ids if user_ids[uid].waiting}
+
+# Build the reverse admin index
+for gid in admin_ids:
+    for uid in admin_ids[gid]:
+        admin_groups.setdefault(uid, set()).add(gid)
+
 # Start program
 copyright_text = (f"SCP-079-{sender} v{version}, Copyright (C) 2019 SCP-079 <https://scp-079.org>\n"
                   "Licensed under the terms of the GNU General Public License v3 or later (GPLv3+)\n")
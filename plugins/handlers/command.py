@@ -26,17 +26,17 @@ from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 from plugins import glovar
 from plugins.functions.channel import get_debug_text, share_data
-from plugins.functions.etc import button_data, code, delay, general_link, get_callback_data, get_command_context
+from plugins.functions.etc import button_data, code, general_link, get_callback_data, get_command_context
 from plugins.functions.etc import get_command_type, get_full_name, get_int, get_now, get_readable_time, lang, mention_id
 from plugins.functions.etc import thread
 from plugins.functions.file import save
 from plugins.functions.filters import (authorized_group, class_d, from_user, is_class_c, is_watch_user, 
                                        is_high_score_user, is_class_e_user, test_group)
-from plugins.functions.group import delete_message, get_config_text, get_message
-from plugins.functions.ids import init_user_id
+from plugins.functions.group import delete_message, get_config_text, get_message, send_report_message
+from plugins.functions.ids import add_expiry, init_user_id, remove_report
 from plugins.functions.user import ban_user, forgive_user, get_admin_text, get_class_d_id, remove_user
 from plugins.functions.user import report_answer, report_user, unban_user, undo_user, warn_user
-from plugins.functions.telegram import get_group_info, resolve_username, send_message, send_report_message
+from plugins.functions.telegram import get_group_info, resolve_username, send_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -71,9 +71,9 @@ def admin(client: Client, message: Message) -> bool:
             return True
 
         # Warned user and the user having report status can't mention admins
-        if (gid in glovar.user_ids[uid]["waiting"]
-                or gid in glovar.user_ids[uid]["ban"]
-                or glovar.user_ids[uid]["warn"].get(gid)):
+        if (gid in glovar.user_ids[uid].waiting
+                or gid in glovar.user_ids[uid].ban
+                or glovar.user_ids[uid].warn.get(gid)):
             return True
 
         # Generate report text
@@ -116,7 +116,9 @@ def admin(client: Client, message: Message) -> bool:
         old_mid, _ = glovar.message_ids.get(gid, (0, 0))
         old_mid and thread(delete_message, (client, gid, old_mid))
         sent_mid = result.message_id
-        glovar.message_ids[gid] = (sent_mid, get_now())
+        now = get_now()
+        glovar.message_ids[gid] = (sent_mid, now)
+        add_expiry("message_ids", gid, now)
         save("message_ids")
 
         return True
@@ -241,7 +243,7 @@ def config(client: Client, message: Message) -> bool:
         logger.warning(f"Config error: {e}", exc_info=True)
     finally:
         if is_class_c(None, None, message):
-            delay(3, delete_message, [client, gid, mid])
+            delete_message(client, gid, mid, 3)
         else:
             delete_message(client, gid, mid)
 
@@ -391,8 +393,7 @@ def forgive(client: Client, message: Message) -> bool:
         # Forgive the user
         reason = get_command_type(message)
         text, success = forgive_user(client, message, uid, reason)
-        glovar.user_ids[uid]["lock"].discard(gid)
-        save("user_ids")
+        glovar.user_ids[uid].discard("lock", gid)
 
         if success:
             secs = 180
@@ -494,11 +495,11 @@ def report(client: Client, message: Message) -> bool:
                 return True
 
             # Check user status
-            bad_user = (gid in glovar.user_ids[rid]["lock"]
-                        or gid in glovar.user_ids[uid]["lock"]
-                        or gid in glovar.user_ids[rid]["waiting"]
-                        or gid in glovar.user_ids[uid]["waiting"]
-                        or gid in glovar.user_ids[uid]["ban"]
+            bad_user = (gid in glovar.user_ids[rid].lock
+                        or gid in glovar.user_ids[uid].lock
+                        or gid in glovar.user_ids[rid].waiting
+                        or gid in glovar.user_ids[uid].waiting
+                        or gid in glovar.user_ids[uid].ban
                         or is_watch_user(message.from_user, "ban", now)
                         or is_watch_user(message.from_user, "delete", now)
                         or is_high_score_user(message.from_user))
@@ -529,7 +530,7 @@ def report(client: Client, message: Message) -> bool:
             if result:
                 glovar.reports[key]["report_id"] = result.message_id
             else:
-                glovar.reports.pop(key, {})
+                remove_report(key)
 
             save("reports")
 
@@ -17,6 +17,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from bisect import bisect_left
+from time import time
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from pyrogram import Client, filters
 from pyrogram.types import Message
@@ -28,12 +31,12 @@ from plugins.functions.file import save
 from plugins.functions.filters import (aio, authorized_group, exchange_channel, from_user, hide_channel, new_group,
                                        test_group)
 from plugins.functions.group import leave_group
-from plugins.functions.ids import init_group_id
+from plugins.functions.ids import discard_user_status, init_group_id, update_admin_ids
 from plugins.functions.receive import receive_add_bad, receive_clear_data, receive_config_commit, receive_config_reply
 from plugins.functions.receive import receive_config_show, receive_declared_message, receive_help_report
 from plugins.functions.receive import receive_leave_approve, receive_refresh, receive_remove_bad, receive_remove_score
 from plugins.functions.receive import receive_remove_watch, receive_rollback, receive_text_data
-from plugins.functions.receive import receive_user_score, receive_watch_user
+from plugins.functions.receive import receive_user_score, receive_user_scores, receive_watch_user
 from plugins.functions.telegram import get_admins, send_message
 from plugins.functions.timers import backup_files
 
@@ -58,12 +61,11 @@ def check_join(client: Client, message: Message) -> bool:
             if not glovar.user_ids.get(uid, {}):
                 continue
 
-            if gid not in glovar.user_ids[uid]["ban"] and gid not in glovar.user_ids[uid]["kick"]:
+            if gid not in glovar.user_ids[uid].ban and gid not in glovar.user_ids[uid].kick:
                 continue
 
-            glovar.user_ids[uid]["ban"].discard(gid)
-            glovar.user_ids[uid]["kick"].discard(gid)
-            save("user_ids")
+            discard_user_status(uid, "ban", gid)
+            discard_user_status(uid, "kick", gid)
             update_score(client, uid)
 
         return True
@@ -148,10 +150,9 @@ def init_group(client: Client, message: Message) -> bool:
             admin_members = get_admins(client, gid)
 
             if admin_members:
-                glovar.admin_ids[gid] = {admin.user.id for admin in admin_members
-                                         if ((not admin.user.is_bot and not admin.user.is_deleted)
-                                             or admin.user.id in glovar.bot_ids)}
-                save("admin_ids")
+                update_admin_ids(gid, {admin.user.id for admin in admin_members
+                                       if ((not admin.user.is_bot and not admin.user.is_deleted)
+                                           or admin.user.id in glovar.bot_ids)})
                 text += f"{lang('status')}{lang('colon')}{code(lang('status_joined'))}\n"
             else:
                 thread(leave_group, (client, gid))
@@ -187,11 +188,11 @@ def init_group(client: Client, message: Message) -> bool:
                    & exchange_channel)
 def process_data(client: Client, message: Message) -> bool:
     # Process the data in exchange channel
-    glovar.locks["receive"].acquire()
     try:
-        data = receive_text_data(message)
+        data = receive_text_data(message, glovar.sender)
 
         if not data:
+            glovar.route_rejected += 1
             return True
 
         sender = data["from"]
@@ -200,173 +201,66 @@ def process_data(client: Client, message: Message) -> bool:
         action_type = data["type"]
         data = data["data"]
 
-        # This will look awkward,
-        # seems like it can be simplified,
-        # but this is to ensure that the permissions are clear,
-        # so it is intentionally written like this
-        if glovar.sender in receivers:
-
-            if sender == "CAPTCHA":
-
-                if action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "CLEAN":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "CONFIG":
-
-                if action == "config":
-                    if action_type == "commit":
-                        receive_config_commit(data)
-                    elif action_type == "reply":
-                        receive_config_reply(client, data)
-
-            elif sender == "LANG":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "LONG":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "MANAGE":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(data)
-
-                elif action == "backup":
-                    if action_type == "now":
-                        thread(backup_files, (client,))
-                    elif action_type == "rollback":
-                        receive_rollback(client, message, data)
-
-                elif action == "clear":
-                    receive_clear_data(client, action_type, data)
-
-                elif action == "config":
-                    if action_type == "show":
-                        receive_config_show(client, data)
-
-                elif action == "leave":
-                    if action_type == "approve":
-                        receive_leave_approve(client, data)
-
-                elif action == "remove":
-                    if action_type == "bad":
-                        receive_remove_bad(data)
-                    elif action_type == "score":
-                        receive_remove_score(data)
-                    elif action_type == "watch":
-                        receive_remove_watch(data)
-
-                elif action == "update":
-                    if action_type == "refresh":
-                        receive_refresh(client, data)
-
-            elif sender == "NOFLOOD":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "NOPORN":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "NOSPAM":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(data)
-
-                elif action == "help":
-                    if action_type == "report":
-                        delay(10, receive_help_report, [client, data])
-                
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-            
-            elif sender == "RECHECK":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-            
-            elif sender == "WATCH":
-
-                if action == "add":
-                    if action_type == "watch":
-                        receive_watch_user(data)
+        if glovar.sender not in receivers:
+            glovar.route_rejected += 1
+            return True
+
+        # The routes are compiled from glovar.permissions, a sender can only reach the handlers declared for it
+        key = (sender, action, action_type)
+        handler = routes.get(key) or routes.get((sender, action, None))
+
+        if not handler:
+            glovar.route_rejected += 1
+            return True
+
+        # The routes that touch shared data are still serialized
+        parallel = (action, action_type) in glovar.parallel_routes
+        parallel or glovar.locks["receive"].acquire()
+
+        try:
+            start = time()
+            handler(client, message, sender, action_type, data)
+            secs = time() - start
+        finally:
+            parallel or glovar.locks["receive"].release()
+
+        with glovar.locks["route"]:
+            stats = glovar.route_stats.setdefault(key, [0] * (len(glovar.route_buckets) + 2))
+            stats[0] += 1
+            stats[1 + bisect_left(glovar.route_buckets, secs)] += 1
 
         return True
     except Exception as e:
         logger.warning(f"Process data error: {e}", exc_info=True)
-    finally:
-        glovar.locks["receive"].release()
 
     return False
+
+
+# The handler of each (action, type), called with (client, message, sender, type, data)
+handlers: Dict[Tuple[str, Optional[str]], Callable[[Client, Message, str, str, Any], Any]] = {
+    ("add", "bad"): lambda client, message, sender, the_type, data: receive_add_bad(data),
+    ("add", "watch"): lambda client, message, sender, the_type, data: receive_watch_user(data),
+    ("backup", "now"): lambda client, message, sender, the_type, data: thread(backup_files, (client,)),
+    ("backup", "rollback"): lambda client, message, sender, the_type, data: receive_rollback(client, message, data),
+    ("clear", None): lambda client, message, sender, the_type, data: receive_clear_data(client, the_type, data),
+    ("config", "commit"): lambda client, message, sender, the_type, data: receive_config_commit(data),
+    ("config", "reply"): lambda client, message, sender, the_type, data: receive_config_reply(client, data),
+    ("config", "show"): lambda client, message, sender, the_type, data: receive_config_show(client, data),
+    ("help", "report"): lambda client, message, sender, the_type, data: delay(10, receive_help_report,
+                                                                                [client, data]),
+    ("leave", "approve"): lambda client, message, sender, the_type, data: receive_leave_approve(client, data),
+    ("remove", "bad"): lambda client, message, sender, the_type, data: receive_remove_bad(data),
+    ("remove", "score"): lambda client, message, sender, the_type, data: receive_remove_score(data),
+    ("remove", "watch"): lambda client, message, sender, the_type, data: receive_remove_watch(data),
+    ("update", "declare"): lambda client, message, sender, the_type, data: receive_declared_message(data),
+    ("update", "refresh"): lambda client, message, sender, the_type, data: receive_refresh(client, data),
+    ("update", "score"): lambda client, message, sender, the_type, data: receive_user_score(sender, data),
+    ("update", "scores"): lambda client, message, sender, the_type, data: receive_user_scores(client, message, sender,
+                                                                                              data)
+}
+
+routes: Dict[Tuple[str, str, Optional[str]], Callable[[Client, Message, str, str, Any], Any]] = {
+    (sender, action, the_type): handlers[(action, the_type)]
+    for (action, the_type), senders in glovar.permissions.items()
+    for sender in senders
+}